@@ -0,0 +1,69 @@
+"""Throughput of concurrent updates with the blocking Backend vs AsyncBackend.
+
+Database latency is emulated with a DeedProcessor stand-in which sleeps like a psycopg2 round-trip,
+so the benchmark does not need a running Postgres.
+
+    python -m benchmarks.async_backend --updates 200 --latency 0.02 --workers 8
+"""
+import argparse
+import asyncio
+import time
+from datetime import datetime
+
+from lib.backend import Backend, AsyncBackend, Response
+
+
+class SlowDeedProcessor:
+    """answers like DeedProcessor, every call holds the caller for `latency` seconds"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def get_deeds_for_user(self, telegram_id: int) -> Response:
+        time.sleep(self.latency)
+        return Response(0, [])
+
+    def insert_deed(self, deed_name: str, telegram_id: int, notify_time: datetime = None) -> Response:
+        time.sleep(self.latency)
+        return Response(0, 1)
+
+
+async def handle_update_blocking(backend: Backend, user_id: int) -> None:
+    backend.add_deed('deed', user_id)
+    backend.get_deed_for_user(user_id)
+
+
+async def handle_update_async(backend: AsyncBackend, user_id: int) -> None:
+    await backend.add_deed('deed', user_id)
+    await backend.get_deed_for_user(user_id)
+
+
+async def run(handler, backend, updates: int) -> float:
+    start = time.perf_counter()
+    await asyncio.gather(*(handler(backend, user_id) for user_id in range(updates)))
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--updates', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--workers', type=int, default=8)
+    args = parser.parse_args()
+
+    backend = Backend(None)
+    backend.deed_processor = SlowDeedProcessor(args.latency)
+    blocking_time = asyncio.run(run(handle_update_blocking, backend, args.updates))
+
+    async_backend = AsyncBackend(None, max_workers=args.workers)
+    async_backend.backend.deed_processor = SlowDeedProcessor(args.latency)
+    async_time = asyncio.run(run(handle_update_async, async_backend, args.updates))
+    async_backend.shutdown()
+
+    print(f"updates={args.updates}, db latency={args.latency * 1000:.0f}ms, workers={args.workers}")
+    print(f"blocking Backend: {blocking_time:.2f}s, {args.updates / blocking_time:.1f} updates/s")
+    print(f"AsyncBackend:     {async_time:.2f}s, {args.updates / async_time:.1f} updates/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,25 @@
+"""Migrated sqlite stand-in of the bot database for benchmarks and harnesses."""
+import os
+import tempfile
+
+from sqlalchemy import create_engine, event
+
+from lib.db.deed import SCHEMA_NAME
+from lib.db.migrations import apply_migrations
+
+
+def build_engine(path: str = None):
+    """engine of a sqlite file shared by threads and instances, a fresh temporary one by default"""
+    path = path or os.path.join(tempfile.mkdtemp(), 'bot.db')
+    engine = create_engine(
+        f'sqlite:///{path}',
+        connect_args={'timeout': 30, 'check_same_thread': False},
+        execution_options={'schema_translate_map': {SCHEMA_NAME: None}},
+    )
+
+    @event.listens_for(engine, 'connect')
+    def set_wal(connection, _):
+        connection.execute('PRAGMA journal_mode=WAL')
+
+    apply_migrations(engine)
+    return engine
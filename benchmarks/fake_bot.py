@@ -0,0 +1,39 @@
+"""Bot which answers Bot API calls locally after a fixed latency, for load tests without telegram."""
+import asyncio
+import time
+
+from telegram.ext import ExtBot
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'harness', 'username': 'harness_bot'}
+
+
+class FakeBot(ExtBot):
+
+    def __init__(self, latency: float = 0.05, token: str = '1:fake'):
+        super().__init__(token)
+        self._latency = latency
+        self._message_id = 0
+        # (endpoint, data, monotonic time of the answer)
+        self.calls: list[tuple[str, dict, float]] = []
+
+    def _answer(self, endpoint: str, data: dict):
+        if endpoint == 'getMe':
+            return BOT_USER
+        if endpoint.startswith('send') or endpoint.startswith('edit'):
+            self._message_id += 1
+            return {
+                'message_id': self._message_id,
+                'date': int(time.time()),
+                'chat': {'id': int(data.get('chat_id', 0)), 'type': 'private'},
+                'from': BOT_USER,
+                'text': data.get('text', ''),
+            }
+        return True
+
+    async def _do_post(self, endpoint: str, data: dict, **kwargs):
+        await asyncio.sleep(self._latency)
+        self.calls.append((endpoint, data, time.monotonic()))
+        return self._answer(endpoint, data)
+
+    def api_calls(self, endpoint: str = None) -> int:
+        return sum(1 for call in self.calls if endpoint is None or call[0] == endpoint)
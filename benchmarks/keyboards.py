@@ -0,0 +1,99 @@
+"""Handler time with precomputed keyboards vs keyboards built on every call.
+
+    python -m benchmarks.keyboards --iterations 5000
+
+The handlers which answer with the day, hour and minute keyboards run against stand-in updates, replies
+only serialize the markup like the bot does before posting it. The uncached run swaps the shared markups
+for their builders.
+"""
+import argparse
+import asyncio
+import os
+import time
+from contextlib import contextmanager
+from datetime import date
+from types import SimpleNamespace
+
+import lib.keyboards as kb
+from lib.client import Client
+from utils.utils import get_menu_names
+
+menu_names = get_menu_names()
+
+
+class FakeMessage:
+
+    def __init__(self, text: str):
+        self.text = text
+
+    async def reply_text(self, text: str, reply_markup=None):
+        reply_markup.to_json()
+
+
+class FakeQuery:
+
+    def __init__(self, data: str, text: str):
+        self.data = data
+        self.message = FakeMessage(text)
+
+    async def answer(self):
+        pass
+
+    async def edit_message_text(self, text: str, reply_markup=None):
+        reply_markup.to_json()
+
+
+@contextmanager
+def uncached():
+    patched = {
+        'get_days': lambda recurrence=None: kb.build_days(date.today(), recurrence),
+        'get_hours': kb.build_hours,
+        'get_minutes': kb.build_minutes,
+        'get_start_keyboard': kb.build_start_keyboard,
+    }
+    originals = {name: getattr(kb, name) for name in patched}
+    for name, function in patched.items():
+        setattr(kb, name, function)
+    try:
+        yield
+    finally:
+        for name, function in originals.items():
+            setattr(kb, name, function)
+
+
+async def run_handlers(client: Client, iterations: int) -> float:
+    context = SimpleNamespace(user_data={})
+    yes = SimpleNamespace(message=FakeMessage(menu_names.yes_))
+    day = SimpleNamespace(callback_query=FakeQuery('d1', 'deed'))
+    hour = SimpleNamespace(callback_query=FakeQuery('hc', '18 Oct, Sun\nhour'))
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        await client.process_notification_fact(yes, context)
+        await client.process_day_callback(day, context, 1)
+        await client.process_hour_callback(hour, context, 12)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iterations', type=int, default=5000)
+    args = parser.parse_args()
+
+    os.environ.setdefault('TZ', 'UTC')
+    time.tzset()
+    client = Client('1:harness', None, metrics_dump_interval=0)
+    handlers = args.iterations * 3
+
+    cached = asyncio.run(run_handlers(client, args.iterations))
+    with uncached():
+        built = asyncio.run(run_handlers(client, args.iterations))
+
+    print(f"handlers={handlers}")
+    print(f"cached   {cached / handlers * 1e6:.1f}us per handler")
+    print(f"uncached {built / handlers * 1e6:.1f}us per handler")
+    print(f"speedup {built / cached:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
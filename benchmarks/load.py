@@ -0,0 +1,269 @@
+"""End-to-end load test: thousands of simulated users drive the handlers against a fake bot and sqlite.
+
+    python -m benchmarks.load --users 1000 --runs 1
+    python -m benchmarks.load --save baseline.json
+    python -m benchmarks.load --compare baseline.json --tolerance 0.25
+
+Users walk the same script in waves, a wave is one step of every user with `concurrency` of them in flight:
+/start, add deed, its name, yes, day, hour, minute, a quick reminder, show deeds, the first deed and done.
+Latency of a step is the time the application takes to process the update, queries are sql statements
+executed against the database per update. Then a notification for every user falls due at the same moment,
+notifications/s is the rate they reach the bot. The bot answers after `latency`, 0 by default so the time
+is spent in client, keyboards and backend only.
+
+Every metric is the median of `runs` runs on fresh databases. With --compare the run fails when a step got
+slower than the baseline by more than `tolerance` at p50 or p99, when a step runs more queries or
+notifications got slower, so a regression shows up as a failed run.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+
+from sqlalchemy import event
+from telegram import InlineKeyboardMarkup, Update
+
+import lib.callbacks as cb
+import utils.utils as ut
+from benchmarks.db import build_engine
+from benchmarks.fake_bot import FakeBot
+from benchmarks.round_trips import CHAT_ID, Taps
+from lib.client import Client
+from lib.db.deed import Deed
+
+menu_names = ut.get_menu_names()
+
+
+class User:
+
+    def __init__(self, index: int):
+        self.index = index
+        self.taps = Taps(CHAT_ID + index)
+        # first deed of the list shown to the user
+        self.deed_id: Optional[int] = None
+
+
+# step name and the update the user sends at it
+STEPS: list[tuple[str, Callable[[User], dict]]] = [
+    ('start', lambda user: user.taps.message('/start')),
+    ('add deed', lambda user: user.taps.message(menu_names.add_deed)),
+    ('deed name', lambda user: user.taps.message(f'deed {user.index}')),
+    ('yes', lambda user: user.taps.message(menu_names.yes_)),
+    ('day', lambda user: user.taps.button(cb.encode(cb.DAY, 1))),
+    ('hour', lambda user: user.taps.button(cb.encode(cb.HOUR, 12), text="day\nhour")),
+    ('minute', lambda user: user.taps.button(cb.encode(cb.MINUTE, 30))),
+    ('quick add', lambda user: user.taps.message(f'call {user.index} tomorrow 10:00')),
+    ('show deeds', lambda user: user.taps.message(menu_names.show_deeds)),
+    ('deed', lambda user: user.taps.button(cb.encode(cb.DEED, user.deed_id))),
+    ('done', lambda user: user.taps.button(cb.encode(cb.DONE, user.deed_id))),
+]
+
+
+class QueryCounter:
+    """sql statements executed by the engine"""
+
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self.on_execute)
+
+    def on_execute(self, *args) -> None:
+        self.count += 1
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def first_deed_id(bot: FakeBot, chat_id: int, since: int) -> Optional[int]:
+    """deed of the first button of the last deeds list sent to the chat"""
+    for endpoint, data, _ in reversed(bot.calls[since:]):
+        if endpoint != 'sendMessage' or data.get('chat_id') != chat_id:
+            continue
+        markup = data.get('reply_markup')
+        if not isinstance(markup, InlineKeyboardMarkup):
+            continue
+        for row in markup.inline_keyboard:
+            for button in row:
+                callback = cb.decode(button.callback_data, (cb.DEED,))
+                if callback:
+                    return callback.args[0]
+    return None
+
+
+async def process(client: Client, bot: FakeBot, update: dict) -> float:
+    start = time.perf_counter()
+    await client.application.process_update(Update.de_json(update, bot))
+    return time.perf_counter() - start
+
+
+async def run_step(client: Client, bot: FakeBot, users: list[User], build_update, concurrency: int) -> list[float]:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send(user: User) -> float:
+        async with semaphore:
+            return await process(client, bot, build_update(user))
+
+    latencies = await asyncio.gather(*[send(user) for user in users])
+    # answers of callback queries are left running by the handlers
+    await asyncio.gather(*client._answers)
+    return latencies
+
+
+async def run_notifications(client: Client, bot: FakeBot, engine, users: list[User], timeout: float) -> dict:
+    """notification of every user falls due at once, returns their rate and lag"""
+    due = ut.localize(datetime.now()) + timedelta(seconds=2)
+    with engine.begin() as connection:
+        connection.execute(Deed.__table__.insert(), [
+            {'telegram_id': user.taps.chat_id, 'name': f'ping {user.index}', 'create_time': datetime.now(),
+             'notify_time': due, 'done_flag': False}
+            for user in users
+        ])
+    await client.load_notifications(due, due + timedelta(seconds=1))
+    due_monotonic = time.monotonic() + (due - ut.localize(datetime.now())).total_seconds()
+
+    def sent() -> list[float]:
+        return [answered_at for endpoint, data, answered_at in bot.calls
+                if endpoint == 'sendMessage' and data.get('text', '').startswith('🔔 ping')]
+
+    while len(sent()) < len(users) and time.monotonic() < due_monotonic + timeout:
+        await asyncio.sleep(0.1)
+    answered = sent()
+    if not answered:
+        return {'sent': 0, 'per_s': 0.0, 'lag_p50_ms': 0.0, 'lag_p99_ms': 0.0}
+    lags = [answered_at - due_monotonic for answered_at in answered]
+    return {
+        'sent': len(answered),
+        'per_s': len(answered) / max(max(lags), 1e-3),
+        'lag_p50_ms': percentile(lags, 0.5) * 1000,
+        'lag_p99_ms': percentile(lags, 0.99) * 1000,
+    }
+
+
+async def run(args) -> dict:
+    engine = build_engine()
+    queries = QueryCounter(engine)
+    bot = FakeBot(latency=args.latency)
+    client = Client('', engine, bot=bot, db_workers=args.db_workers, metrics_dump_interval=0, concurrent_chats=0,
+                    persistence_interval=0, scheduler_engine='heap', notification_rate=args.notification_rate,
+                    notification_chat_interval=0)
+    client.setup_application()
+    application = client.application
+    await application.initialize()
+    await application.start()
+    await client.post_init(application)
+    await client.refill_notifications(None)
+
+    users = [User(index) for index in range(args.users)]
+    steps = {}
+    started = time.perf_counter()
+    for name, build_update in STEPS:
+        calls = len(bot.calls)
+        queries.count = 0
+        latencies = await run_step(client, bot, users, build_update, args.concurrency)
+        steps[name] = {
+            'p50_ms': percentile(latencies, 0.5) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+            'queries': queries.count / len(users),
+        }
+        if name == 'show deeds':
+            for user in users:
+                user.deed_id = first_deed_id(bot, user.taps.chat_id, calls)
+            missing = sum(1 for user in users if user.deed_id is None)
+            if missing:
+                raise RuntimeError(f"{missing} users got no deeds list")
+    elapsed = time.perf_counter() - started
+
+    notifications = await run_notifications(client, bot, engine, users, args.timeout)
+
+    await application.stop()
+    await client.post_shutdown(application)
+    await application.shutdown()
+    client.backend.shutdown()
+
+    return {
+        'users': args.users,
+        'latency': args.latency,
+        'steps': steps,
+        'updates_per_s': len(users) * len(STEPS) / elapsed,
+        'notifications': notifications,
+    }
+
+
+def median_result(results: list[dict]) -> dict:
+    """median of every number of results of the runs"""
+    first = results[0]
+    if isinstance(first, dict):
+        return {key: median_result([result[key] for result in results]) for key in first}
+    return statistics.median(results)
+
+
+def report(result: dict) -> None:
+    print(f"users={result['users']} latency={result['latency'] * 1000:.0f}ms "
+          f"{result['updates_per_s']:.0f} updates/s")
+    print(f"{'step':<12}{'p50':>10}{'p99':>10}{'queries':>9}")
+    for name, step in result['steps'].items():
+        print(f"{name:<12}{step['p50_ms']:>8.1f}ms{step['p99_ms']:>8.1f}ms{step['queries']:>9.2f}")
+    notifications = result['notifications']
+    print(f"notifications sent={notifications['sent']}/{result['users']} {notifications['per_s']:.0f}/s "
+          f"lag p50={notifications['lag_p50_ms']:.0f}ms p99={notifications['lag_p99_ms']:.0f}ms")
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list[str]:
+    """regressions of result against baseline"""
+    regressions = []
+    for name, step in result['steps'].items():
+        base = baseline['steps'].get(name)
+        if base is None:
+            continue
+        for key in ('p50_ms', 'p99_ms'):
+            if step[key] > base[key] * (1 + tolerance):
+                regressions.append(f"{name} {key} {base[key]:.1f} -> {step[key]:.1f}")
+        if step['queries'] > base['queries'] + 0.01:
+            regressions.append(f"{name} queries {base['queries']:.2f} -> {step['queries']:.2f}")
+    notifications, base = result['notifications'], baseline['notifications']
+    if notifications['sent'] < base['sent']:
+        regressions.append(f"notifications sent {base['sent']} -> {notifications['sent']}")
+    if notifications['per_s'] < base['per_s'] / (1 + tolerance):
+        regressions.append(f"notifications/s {base['per_s']:.0f} -> {notifications['per_s']:.0f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--concurrency', type=int, default=64, help='updates in flight at once')
+    parser.add_argument('--latency', type=float, default=0, help='seconds of every bot api call')
+    parser.add_argument('--db-workers', type=int, default=8)
+    parser.add_argument('--notification-rate', type=float, default=100000, help='notifications per second')
+    parser.add_argument('--timeout', type=float, default=60, help='seconds to wait for notifications')
+    parser.add_argument('--save', help='write the result as json baseline')
+    parser.add_argument('--compare', help='json baseline to check the result against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown against the baseline')
+    args = parser.parse_args()
+
+    os.environ.setdefault('TZ', 'UTC')
+    time.tzset()
+    result = median_result([asyncio.run(run(args)) for _ in range(args.runs)])
+    report(result)
+
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump(result, file, indent=2)
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(result, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f"regression: {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
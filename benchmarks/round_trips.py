@@ -0,0 +1,128 @@
+"""Time of every tap of the scheduling flow against a bot with injected network latency.
+
+    python -m benchmarks.round_trips --latency 0.1 --rounds 5
+
+Updates go through the application like in webhook mode, a tap is over when all Bot API calls it caused
+have been answered. `serial` is what the tap costs when its calls are awaited one after another, i.e. the
+number of calls times latency, `measured` includes the overlapping calls and the database work.
+"""
+import argparse
+import asyncio
+import os
+import time
+from collections import defaultdict
+
+from telegram import Update
+
+import lib.callbacks as cb
+import utils.utils as ut
+from benchmarks.db import build_engine
+from benchmarks.fake_bot import FakeBot
+from lib.client import Client
+
+menu_names = ut.get_menu_names()
+
+CHAT_ID = 10000
+
+
+class Taps:
+    """updates of one user, as telegram sends them"""
+
+    def __init__(self, chat_id: int = CHAT_ID):
+        self.chat_id = chat_id
+        self.user = {'id': chat_id, 'is_bot': False, 'first_name': f'user{chat_id}'}
+        self.chat = {'id': chat_id, 'type': 'private'}
+        self.update_id = 0
+
+    def _next_id(self) -> int:
+        self.update_id += 1
+        return self.update_id
+
+    def message(self, text: str) -> dict:
+        update_id = self._next_id()
+        message = {'message_id': update_id, 'date': int(time.time()), 'chat': self.chat, 'from': self.user,
+                   'text': text}
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text)}]
+        return {'update_id': update_id, 'message': message}
+
+    def button(self, data: str, text: str = '') -> dict:
+        update_id = self._next_id()
+        message = {'message_id': update_id, 'date': int(time.time()), 'chat': self.chat, 'text': text}
+        query = {'id': str(update_id), 'chat_instance': str(self.chat_id), 'from': self.user, 'data': data,
+                 'message': message}
+        return {'update_id': update_id, 'callback_query': query}
+
+
+def flow(taps: Taps, deed_id: int) -> list[tuple[str, dict]]:
+    return [
+        ('add deed', taps.message(menu_names.add_deed)),
+        ('deed name', taps.message(f'deed {deed_id}')),
+        ('yes', taps.message(menu_names.yes_)),
+        ('day', taps.button(cb.encode(cb.DAY, 1))),
+        ('hour', taps.button(cb.encode(cb.HOUR, 12), text="day\nhour")),
+        ('minute', taps.button(cb.encode(cb.MINUTE, 30))),
+        ('timer', taps.button(cb.encode(cb.NOTIFY_TIMER, deed_id))),
+        ('postpone', taps.button(cb.encode(cb.POSTPONE, 5))),
+        ('done', taps.button(cb.encode(cb.NOTIFY_DONE, deed_id))),
+    ]
+
+
+async def tap(client: Client, bot: FakeBot, update: dict) -> tuple[float, int]:
+    calls = len(bot.calls)
+    start = time.perf_counter()
+    await client.application.process_update(Update.de_json(update, bot))
+    # answers of callback queries run in background, the tap is over with them
+    await asyncio.gather(*client._answers)
+    return time.perf_counter() - start, len(bot.calls) - calls
+
+
+async def run(args) -> None:
+    bot = FakeBot(latency=args.latency)
+    client = Client('', build_engine(), bot=bot, metrics_dump_interval=0, concurrent_chats=0,
+                    persistence_interval=0)
+    client.setup_application()
+    application = client.application
+    await application.initialize()
+    await application.start()
+    await client.post_init(application)
+
+    taps = Taps()
+    await tap(client, bot, taps.message('/start'))
+    measured = defaultdict(list)
+    calls = {}
+    for deed_id in range(1, args.rounds + 1):
+        for name, update in flow(taps, deed_id):
+            elapsed, calls[name] = await tap(client, bot, update)
+            measured[name].append(elapsed)
+
+    await application.stop()
+    await client.post_shutdown(application)
+    await application.shutdown()
+    client.backend.shutdown()
+
+    print(f"latency={args.latency * 1000:.0f}ms rounds={args.rounds}")
+    print(f"{'tap':<10}{'calls':>6}{'serial':>10}{'measured':>10}")
+    total_serial = total_measured = 0
+    for name, times in measured.items():
+        serial = calls[name] * args.latency
+        mean = sum(times) / len(times)
+        total_serial += serial
+        total_measured += mean
+        print(f"{name:<10}{calls[name]:>6}{serial * 1000:>8.0f}ms{mean * 1000:>8.0f}ms")
+    print(f"{'flow':<10}{sum(calls.values()):>6}{total_serial * 1000:>8.0f}ms{total_measured * 1000:>8.0f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--latency', type=float, default=0.1, help='seconds of every bot api call')
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    os.environ.setdefault('TZ', 'UTC')
+    time.tzset()
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
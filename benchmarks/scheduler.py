@@ -0,0 +1,86 @@
+"""Memory and schedule/cancel cost of notification scheduler engines.
+
+    python -m benchmarks.scheduler --sizes 100000 1000000
+
+JobQueueScheduler with a million pending jobs takes minutes to fill, use --engines heap for the largest sizes.
+"""
+import argparse
+import asyncio
+import gc
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from telegram.ext import Application
+
+from lib.scheduler import JobQueueScheduler, HeapScheduler
+
+
+async def notification(deed_id: int, user_id: int) -> None:
+    pass
+
+
+def build_scheduler(engine: str):
+    if engine == 'heap':
+        return HeapScheduler(notification), None
+    # job queue holds only a weak reference to the application
+    application = Application.builder().token('1:benchmark').build()
+    return JobQueueScheduler(application.job_queue, notification), application
+
+
+async def measure(engine: str, size: int) -> dict:
+    scheduler, application = build_scheduler(engine)
+    if application:
+        await application.job_queue.start()
+    scheduler.start()
+
+    # spread over a month so nothing fires during the benchmark
+    start_time = datetime.now().astimezone() + timedelta(days=1)
+    times = [start_time + timedelta(seconds=index % (30 * 24 * 3600)) for index in range(size)]
+
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    for deed_id, when in enumerate(times):
+        scheduler.schedule(deed_id, deed_id, when)
+    schedule_time = time.perf_counter() - start
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for deed_id in range(0, size, 2):
+        scheduler.schedule(deed_id, deed_id, times[-deed_id - 1])
+    reschedule_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for deed_id in range(size):
+        scheduler.cancel(deed_id)
+    cancel_time = time.perf_counter() - start
+
+    await scheduler.stop()
+    if application:
+        await application.job_queue.stop()
+
+    return {
+        'bytes per reminder': memory / size,
+        'schedule us': schedule_time / size * 1e6,
+        'reschedule us': reschedule_time / (size / 2) * 1e6,
+        'cancel us': cancel_time / size * 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100000])
+    parser.add_argument('--engines', nargs='+', default=['job_queue', 'heap'])
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        for engine in args.engines:
+            result = asyncio.run(measure(engine, size))
+            stats = ', '.join(f"{name}={value:.1f}" for name, value in result.items())
+            print(f"{engine:>9} n={size}: {stats}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+"""Several bot instances sharing one database deliver every reminder exactly once.
+
+    python -m benchmarks.sharding --instances 3 --deeds 300 --duration 20
+
+Instances run in one process against one sqlite file, every one with its own backend, scheduler, shard
+leases and a fake bot which records sent messages. During the run the first instance stops without
+releasing its leases, like a crashed one, and a new instance joins later. With --shards 0 the instances
+don't coordinate and every reminder comes once per instance. The run exits with an error when a reminder
+is missing or, with shards, duplicated.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+
+import utils.utils as ut
+from benchmarks.db import build_engine
+from lib.client import Client
+from lib.db.deed import Deed
+
+
+class RecordingBot:
+
+    def __init__(self, name: str, deliveries: list):
+        self.name = name
+        self.deliveries = deliveries
+
+    async def send_message(self, chat_id: int, text: str, reply_markup=None):
+        self.deliveries.append((self.name, text, time.time()))
+
+
+class Instance:
+    """Client with the repeating jobs of its job queue run as plain tasks"""
+
+    def __init__(self, name: str, engine, deliveries: list, args):
+        self.name = name
+        self.client = Client(
+            '1:harness',
+            engine,
+            metrics_dump_interval=0,
+            cache_size=0,
+            notification_window=timedelta(seconds=args.window),
+            notification_rate=1000,
+            notification_chat_interval=0,
+            scheduler_engine='heap',
+            notification_shards=args.shards,
+            shard_lease_ttl=args.lease_ttl,
+            instance_id=name,
+        )
+        self.bot = RecordingBot(name, deliveries)
+        self.tasks = []
+
+    async def _repeat(self, job, interval: float):
+        while True:
+            await job(None)
+            await asyncio.sleep(interval)
+
+    async def start(self):
+        self.client.dispatcher.start(self.bot)
+        self.client.scheduler.start()
+        if self.client.shards:
+            self.tasks.append(asyncio.create_task(self._repeat(self.client.rebalance_shards,
+                                                               self.client.shards.lease_ttl / 3)))
+        refill_interval = self.client.notification_window.total_seconds() / 2
+        self.tasks.append(asyncio.create_task(self._repeat(self.client.refill_notifications, refill_interval)))
+
+    async def crash(self):
+        """stops firing without releasing leases, messages already queued are still sent"""
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        await self.client.scheduler.stop()
+        await self.client.dispatcher.stop()
+
+    async def stop(self):
+        await self.crash()
+        if self.client.shards:
+            await self.client.shards.release()
+        self.client.backend.shutdown()
+
+
+def insert_deeds(engine, count: int, users: int, start: datetime, duration: float) -> None:
+    rows = [
+        {
+            'telegram_id': 1000 + index % users,
+            'name': f'deed-{index}',
+            'create_time': datetime.now(),
+            'notify_time': start + timedelta(seconds=duration * index / count),
+            'done_flag': False,
+        }
+        for index in range(count)
+    ]
+    with engine.begin() as connection:
+        connection.execute(insert(Deed.__table__), rows)
+
+
+async def run(args) -> bool:
+    """True if every reminder came as expected"""
+    engine = build_engine()
+    start = ut.localize(datetime.now()) + timedelta(seconds=2)
+    insert_deeds(engine, args.deeds, args.users, start, args.duration)
+    due = {f'🔔 deed-{index}': start.timestamp() + args.duration * index / args.deeds for index in range(args.deeds)}
+
+    deliveries = []
+    instances = [Instance(f'instance-{index}', engine, deliveries, args) for index in range(args.instances)]
+    for instance in instances:
+        await instance.start()
+
+    await asyncio.sleep(2 + args.duration / 3)
+    print(f"{instances[0].name} crashes")
+    await instances[0].crash()
+
+    await asyncio.sleep(args.duration / 6)
+    joined = Instance(f'instance-{args.instances}', engine, deliveries, args)
+    print(f"{joined.name} joins")
+    await joined.start()
+    instances.append(joined)
+
+    # crashed leases expire after lease_ttl, the new owner sends what was left undelivered
+    await asyncio.sleep(args.duration / 2 + args.lease_ttl * 2)
+    for instance in instances[1:]:
+        await instance.stop()
+
+    counts = Counter(text for _, text, _ in deliveries)
+    duplicated = sum(1 for text in due if counts[text] > 1)
+    missing = sum(1 for text in due if not counts[text])
+    delays = sorted(sent_at - due[text] for _, text, sent_at in deliveries)
+    by_instance = Counter(name for name, _, _ in deliveries)
+
+    print(f"deeds={args.deeds} deliveries={len(deliveries)} duplicated={duplicated} missing={missing}")
+    print(f"delay p50={delays[len(delays) // 2]:.2f}s max={delays[-1]:.2f}s")
+    print('by instance: ' + ', '.join(f"{name}={count}" for name, count in sorted(by_instance.items())))
+    print('exactly once' if not duplicated and not missing else 'NOT exactly once')
+    # without shards every instance sends every reminder
+    return not missing and not (duplicated and args.shards)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--instances', type=int, default=3)
+    parser.add_argument('--shards', type=int, default=16)
+    parser.add_argument('--deeds', type=int, default=300)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--duration', type=float, default=20, help='seconds over which reminders are due')
+    parser.add_argument('--window', type=float, default=10, help='notification window in seconds')
+    parser.add_argument('--lease-ttl', type=float, default=3)
+    args = parser.parse_args()
+
+    os.environ.setdefault('TZ', 'UTC')
+    time.tzset()
+    if not asyncio.run(run(args)):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""Load test of webhook mode: synthetic updates are posted to the embedded webhook server.
+
+    python -m benchmarks.webhook --chats 200 --rounds 3 --latency 0.05
+    python -m benchmarks.webhook --concurrent-chats 0
+
+Every chat walks the add deed conversation (/start, add deed, deed name, no notification) `rounds` times,
+its updates are posted in order while chats are posted concurrently. The bot answers API calls after
+`latency`. Reported latency is from posting an update to the reply of the bot. The deed count checks that
+updates of every chat were processed in order, otherwise conversation states break and deeds are lost.
+"""
+import argparse
+import asyncio
+import os
+import socket
+import time
+
+import httpx
+from sqlalchemy import select, func
+
+import utils.utils as ut
+from benchmarks.db import build_engine
+from benchmarks.fake_bot import FakeBot
+from lib.client import Client
+from lib.db.deed import Deed
+from lib.persistence import flush_time, flushed_rows
+
+menu_names = ut.get_menu_names()
+
+SECRET = 'harness-secret'
+
+
+def message_update(update_id: int, chat_id: int, text: str) -> dict:
+    message = {
+        'message_id': update_id,
+        'date': int(time.time()),
+        'chat': {'id': chat_id, 'type': 'private'},
+        'from': {'id': chat_id, 'is_bot': False, 'first_name': f'user{chat_id}'},
+        'text': text,
+    }
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text)}]
+    return {'update_id': update_id, 'message': message}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def post_chat(http: httpx.AsyncClient, url: str, chat_id: int, rounds: int, next_update_id,
+                    posted: dict) -> None:
+    texts = []
+    for round_ in range(rounds):
+        texts += ['/start', menu_names.add_deed, f'deed {chat_id}-{round_}', menu_names.no_]
+    for text in texts:
+        posted.setdefault(chat_id, []).append(time.monotonic())
+        response = await http.post(url, json=message_update(next_update_id(), chat_id, text),
+                                   headers={'X-Telegram-Bot-Api-Secret-Token': SECRET})
+        response.raise_for_status()
+
+
+async def run(args) -> None:
+    engine = build_engine()
+    bot = FakeBot(latency=args.latency)
+    client = Client('', engine, bot=bot, metrics_dump_interval=0, concurrent_chats=args.concurrent_chats,
+                    persistence_interval=args.persistence_interval)
+    client.setup_application()
+    application = client.application
+
+    port = free_port()
+    await application.initialize()
+    await application.updater.start_webhook(listen='127.0.0.1', port=port, url_path='webhook', secret_token=SECRET)
+    await application.start()
+    await client.post_init(application)
+
+    chat_ids = [10000 + index for index in range(args.chats)]
+    expected_replies = args.chats * args.rounds * 4
+    update_ids = iter(range(1, expected_replies + 1))
+    posted: dict[int, list[float]] = {}
+
+    started = time.monotonic()
+    limits = httpx.Limits(max_connections=40)
+    async with httpx.AsyncClient(limits=limits, timeout=30) as http:
+        url = f'http://127.0.0.1:{port}/webhook'
+        await asyncio.gather(*[post_chat(http, url, chat_id, args.rounds, lambda: next(update_ids), posted)
+                               for chat_id in chat_ids])
+
+    while bot.api_calls('sendMessage') < expected_replies and time.monotonic() - started < args.timeout:
+        await asyncio.sleep(0.05)
+    elapsed = time.monotonic() - started
+
+    await application.updater.stop()
+    await application.stop()
+    await client.post_shutdown(application)
+    await application.shutdown()
+    client.backend.shutdown()
+
+    replied: dict[int, list[float]] = {}
+    for endpoint, data, answered_at in bot.calls:
+        if endpoint == 'sendMessage':
+            replied.setdefault(int(data['chat_id']), []).append(answered_at)
+    latencies = sorted(answered_at - posted_at
+                       for chat_id in chat_ids
+                       for posted_at, answered_at in zip(posted[chat_id], replied.get(chat_id, [])))
+
+    with engine.connect() as connection:
+        deeds = connection.execute(select(func.count()).select_from(Deed.__table__)).scalar()
+
+    replies = sum(len(times) for times in replied.values())
+    print(f"concurrent_chats={args.concurrent_chats} chats={args.chats} updates={expected_replies} "
+          f"replies={replies} in {elapsed:.2f}s, {replies / elapsed:.0f} updates/s")
+    if latencies:
+        print(f"latency p50={latencies[len(latencies) // 2] * 1000:.0f}ms "
+              f"p99={latencies[int(len(latencies) * 0.99)] * 1000:.0f}ms")
+    print(f"deeds={deeds} expected={args.chats * args.rounds}")
+    if args.persistence_interval:
+        print(f"persistence flushes={flush_time.count()} "
+              f"user_data rows={flushed_rows.value(kind='user_data'):.0f} "
+              f"conversation rows={flushed_rows.value(kind='conversation'):.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chats', type=int, default=200)
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds of every bot api call')
+    parser.add_argument('--concurrent-chats', type=int, default=64)
+    parser.add_argument('--persistence-interval', type=float, default=5, help='0 keeps conversations in memory')
+    parser.add_argument('--timeout', type=float, default=300)
+    args = parser.parse_args()
+
+    os.environ.setdefault('TZ', 'UTC')
+    time.tzset()
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""Application which processes updates of different chats concurrently.
+
+Update fetcher of python-telegram-bot hands updates over one by one in arrival order. Here process_update
+only puts the update into the queue of its chat and returns, every chat with pending updates has one
+worker task which processes them in order. So ConversationHandler state and user_data of a chat are never
+changed by two handlers at once, while a slow handler of one chat doesn't hold up the others.
+"""
+from collections import deque
+from typing import Hashable
+from telegram import Update
+from telegram.ext import Application
+import asyncio
+import logging
+
+from lib.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+busy_chats = registry.gauge('update_chats_in_progress', 'chats with updates being processed or waiting')
+
+
+class ChatOrderedApplication(Application):
+
+    def __init__(self, max_concurrent_chats: int = 64, **kwargs):
+        super().__init__(**kwargs)
+        self.max_concurrent_chats = max_concurrent_chats
+        self._chat_slots = asyncio.BoundedSemaphore(max_concurrent_chats)
+        self._chat_queues: dict[Hashable, deque] = {}
+        busy_chats.set_function(lambda: len(self._chat_queues))
+
+    @staticmethod
+    def chat_key(update: object) -> Hashable:
+        """updates without chat and user, e.g. polls, are ordered among themselves"""
+        if isinstance(update, Update):
+            if update.effective_chat:
+                return update.effective_chat.id
+            if update.effective_user:
+                return update.effective_user.id
+        return None
+
+    async def process_update(self, update: object) -> None:
+        key = self.chat_key(update)
+        queue = self._chat_queues.get(key)
+        if queue is not None:
+            queue.append(update)
+            return None
+
+        self._chat_queues[key] = deque([update])
+        self.create_task(self._process_chat(key))
+
+    async def _process_chat(self, key: Hashable) -> None:
+        queue = self._chat_queues[key]
+        try:
+            while queue:
+                update = queue.popleft()
+                async with self._chat_slots:
+                    try:
+                        await super().process_update(update)
+                    except Exception:
+                        # already passed to the error handlers by process_update
+                        pass
+        finally:
+            del self._chat_queues[key]
+            if queue:
+                logger.error(f"{len(queue)} updates of chat {key} were dropped")
@@ -1,16 +1,25 @@
-from sqlalchemy import create_engine, insert, func
-from sqlalchemy.orm import scoped_session, Session
+from sqlalchemy import insert, update, select, func, bindparam, or_
 from sqlalchemy.orm import sessionmaker
+from abc import ABC, abstractmethod
+from concurrent.futures import Executor, ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import Any
+from functools import partial, wraps
+from typing import Any, AsyncIterator, Hashable, Iterable, Iterator, Optional
 from datetime import datetime
+import asyncio
 import logging
+import time
 
 from lib.db.deed import Deed
+from lib.cache import DeedCache
+from lib.metrics import registry, timed
 from configs.definitions import ROOT_DIR
 
 logger = logging.getLogger(__name__)
 
+db_method_time = registry.histogram('db_method_seconds', 'time of DeedProcessor methods by method')
+db_method_errors = registry.counter('db_method_errors_total', 'failed DeedProcessor calls by method')
+
 
 @dataclass
 class Response:
@@ -19,84 +28,152 @@ class Response:
     answer: Any  # result
 
 
-def db_executor(func):
-    """create and close sqlalchemy session for class methods which execute sql statement"""
-    def inner(*args, **kwargs):
-        self_ = args[0]
+@dataclass
+class DeedsPage:
+    """page of deed list with keyset cursors, cursor is None when there is no page in that direction"""
+    deeds: list[Deed]
+    prev_before_id: Optional[int]
+    next_after_id: Optional[int]
+
 
-        with Session(self_.engine) as session:
-            func(*args, **kwargs, session=session)
-            session.commit()
+def db_executor(func):
+    """run class method which executes sql statement inside a transaction;
+    joins the unit of work of the passed session or opens and commits its own one"""
+    @wraps(func)
+    def inner(self_, *args, session=None, **kwargs):
+        if session is not None:
+            return func(self_, *args, session=session, **kwargs)
+
+        with self_.Session.begin() as session:
+            return func(self_, *args, session=session, **kwargs)
     return inner
 
 
-def db_selector(func):
-    """create and close sqlalchemy session for class methods which return query result"""
+def db_timed(func):
+    """observe time of a processor method, error status of its Response is counted like an exception"""
+    @timed(db_method_time, db_method_errors, method=func.__name__)
+    @wraps(func)
     def inner(*args, **kwargs):
-        self_ = args[0]
+        response = func(*args, **kwargs)
+        if isinstance(response, Response) and response.status:
+            db_method_errors.inc(method=func.__name__)
+        return response
+    return inner
+
 
-        with Session(self_.engine) as session:
-            result = func(*args, **kwargs, session=session)
-            return result
+def db_selector(func):
+    """run class method which returns query result with the passed session or with its own short one"""
+    @wraps(func)
+    def inner(self_, *args, session=None, **kwargs):
+        if session is not None:
+            return func(self_, *args, session=session, **kwargs)
+
+        with self_.Session() as session:
+            return func(self_, *args, session=session, **kwargs)
     return inner
 
 
+async def run_in_executor(executor: Executor, method, *args):
+    """await a blocking call made in the executor, so it doesn't block the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, partial(method, *args))
+
+
 class TableProcessor:
 
     def __init__(self, engine):
-        session_factory = sessionmaker(bind=engine)
         self.engine = engine
-        self.Session = scoped_session(session_factory)
+        self.Session = sessionmaker(bind=engine, expire_on_commit=False)
 
     @db_selector
-    def get_query_result(self, query: "sqlalchemy.orm.query.Query", session=None) -> list["table_model"]:
-        logger.error('inside get query result 1')
+    def get_query_result(self, query: "sqlalchemy.sql.Select", session=None) -> list["table_model"]:
+        logger.debug('inside get query result 1')
         result = session.execute(query).scalars().all()
-        logger.error('inside get query result 2')
+        logger.debug('inside get query result 2')
         return result
 
+    def _stream_query_result(self, query: "sqlalchemy.sql.Select", batch_size: int,
+                             method: str) -> Iterator[list["table_model"]]:
+        """yield query result by batches over server side cursor, session is open until iterator is exhausted;
+        the query and every fetch are observed in db_method_seconds as method, the consumer's time is not"""
+        start = time.perf_counter()
+        try:
+            with self.Session() as session:
+                result = session.execute(query.execution_options(yield_per=batch_size))
+                for batch in result.scalars().partitions():
+                    db_method_time.observe(time.perf_counter() - start, method=method)
+                    yield batch
+                    start = time.perf_counter()
+                # fetch which found the end of the result
+                db_method_time.observe(time.perf_counter() - start, method=method)
+        except Exception as e:
+            db_method_errors.inc(method=method)
+            logger.error(f"query streaming was interrupted, exception - {e}")
+            raise
+
     @db_executor
-    def _insert_values(self, table_model: "sqlalchemy.orm.decl_api.DeclarativeMeta", data: dict, session=None) -> None:
+    def _insert_values(self, table_model: "sqlalchemy.orm.decl_api.DeclarativeMeta", data: dict, session=None) -> Any:
+        """insert one row and return its primary key, generated by the database if it is not in data"""
         ins_command = insert(table_model).values(**data)
-        session.execute(ins_command)
+        result = session.execute(ins_command)
+        return result.inserted_primary_key[0]
+
+    @db_executor
+    def _insert_many_values(self, table_model: "sqlalchemy.orm.decl_api.DeclarativeMeta", data: list[dict],
+                            session=None) -> list:
+        """insert rows with one statement and return their primary keys"""
+        if session.get_bind().dialect.full_returning:
+            ins_command = insert(table_model).values(data).returning(table_model.id)
+            return session.execute(ins_command).scalars().all()
+
+        # dialects without RETURNING (sqlite stand-in) insert row by row in the same transaction
+        return [session.execute(insert(table_model).values(**row)).inserted_primary_key[0] for row in data]
 
     @db_selector
     def _get_all_data(self, table_model: "sqlalchemy.orm.decl_api.DeclarativeMeta", session=None) -> list[
         'table_model']:
-        query = session.query(table_model)
-        result = self.get_query_result(query)
+        query = select(table_model)
+        result = self.get_query_result(query, session=session)
         return result
 
     @db_selector
     def _get_filtered_data(self, table_model, filter_values: dict, session=None) -> list['table_model']:
-        logger.error('inside selector')
-        query = session.query(table_model)
-        logger.error('inside selector2')
+        logger.debug('inside selector')
+        query = select(table_model)
+        logger.debug('inside selector2')
         for filter_column in filter_values:
-            query = query.filter(getattr(table_model, filter_column) == filter_values[filter_column])
-        logger.error('inside selector3')
-        result = self.get_query_result(query)
-        logger.error('inside selector4')
+            query = query.where(getattr(table_model, filter_column) == filter_values[filter_column])
+        logger.debug('inside selector3')
+        result = self.get_query_result(query, session=session)
+        logger.debug('inside selector4')
         return result
 
     @db_executor
     def _change_column_value(self, table_model, filter_values: dict, change_values: dict, session=None) -> None:
-        query = session.query(table_model)
+        command = update(table_model)
         for filter_column in filter_values:
-            query = query.filter(getattr(table_model, filter_column) == filter_values[filter_column])
-        query.update(change_values)
+            command = command.where(getattr(table_model, filter_column) == filter_values[filter_column])
+        session.execute(command.values(**change_values))
 
-    @db_selector
-    def _get_max_value_of_column(self, table_model, column: str, session=None):
-
-        query = func.max(getattr(table_model, column))
-        result = self.get_query_result(query)[0]
-
-        # case with empty table
-        if not result:
-            result = 0
+    @db_executor
+    def _change_column_value_for_keys(self, table_model, key_column: str, keys: list, change_values: dict,
+                                      session=None) -> None:
+        """set the same change_values for every row with key_column in keys, one UPDATE ... WHERE key IN (...)"""
+        command = update(table_model).where(getattr(table_model, key_column).in_(keys)).values(**change_values)
+        session.execute(command)
 
-        return result
+    @db_executor
+    def _change_column_value_by_key(self, table_model, key_column: str, change_column: str, values: dict,
+                                    change_values: dict = None, session=None) -> None:
+        """set individual change_column value for every key of values and the same change_values for all of them,
+        one executemany UPDATE"""
+        table = table_model.__table__
+        command = (
+            update(table)
+            .where(table.c[key_column] == bindparam('b_key'))
+            .values({change_column: bindparam('b_value'), **(change_values or {})})
+        )
+        session.execute(command, [{'b_key': key, 'b_value': value} for key, value in values.items()])
 
 
 class DeedProcessor(TableProcessor):
@@ -105,43 +182,96 @@ class DeedProcessor(TableProcessor):
         super().__init__(engine)
         self.table_model = Deed
 
-    def insert_deed(self, deed_name: str, telegram_id: int) -> int:
-
+    @db_timed
+    def insert_deed(self, deed_name: str, telegram_id: int, notify_time: datetime = None, session=None) -> int:
+        """deed with notify_time is inserted with its notification in one statement"""
         try:
-            current_id = self.get_max_id() + 1
             data = {
-                'id': current_id,
                 'telegram_id': telegram_id,
                 'name': deed_name,
                 'create_time': datetime.now(),
-                'notify_time': None,
+                'notify_time': notify_time,
                 'done_flag': False,
             }
-            self._insert_values(self.table_model, data)
+            current_id = self._insert_values(self.table_model, data, session=session)
             logger.info(f"deed '{deed_name}' was inserted to DB")
             return Response(0, current_id)
         except Exception as e:
             logger.error(f"deed '{deed_name}' was not inserted to DB, exception - {e}")
             return Response(1, e)
 
-    def get_all_active_deeds(self) -> list[Deed]:
-        filter_values = {
-            'done_flag': False
-        }
+    def get_all_active_deeds(self, since: datetime, until: datetime = None, batch_size: int = 1000,
+                             num_shards: int = 0, shards: Iterable[int] = None,
+                             undelivered_only: bool = False) -> Response:
+        """undone deeds with notification at [since, until) ordered by notify_time,
+        answer is iterator over batches of at most batch_size deeds;
+        with num_shards only deeds of users in the passed shards are returned"""
+        model = self.table_model
+        query = (
+            select(model)
+            .where(~model.done_flag)
+            .where(model.notify_time >= since)
+            .order_by(model.notify_time)
+        )
+        if until:
+            query = query.where(model.notify_time < until)
+        if num_shards:
+            query = query.where((func.abs(model.telegram_id) % num_shards).in_(list(shards)))
+        if undelivered_only:
+            query = query.where(or_(model.notified_at.is_(None), model.notified_at != model.notify_time))
+
+        # query is executed lazily on the first batch, errors are logged and timed by the stream
+        batches = self._stream_query_result(query, batch_size, 'get_all_active_deeds')
+        logger.info(f"active deeds stream since {since} until {until} was passed")
+        return Response(0, batches)
+
+    @db_timed
+    def get_overdue_recurring_deeds(self, before: datetime, session=None) -> Response(int, list[Deed]):
+        """undone recurring deeds whose next occurrence is before the passed time, missed while bot was down"""
+        model = self.table_model
+        query = (
+            select(model)
+            .where(~model.done_flag)
+            .where(model.recurrence.is_not(None))
+            .where(model.notify_time < before)
+        )
         try:
-            logger.error('try to get data')
-            deeds = self._get_filtered_data(self.table_model, filter_values)
-            active_deeds = [deed for deed in deeds if deed.notify_time]
-            logger.info(f"all active deeds was passed")
-            return Response(0, active_deeds)
+            deeds = self.get_query_result(query, session=session)
+            logger.info(f"returned {len(deeds)} overdue recurring deeds")
+            return Response(0, deeds)
         except Exception as e:
-            logger.error(f"all active deeds was not passed, exception - {e}")
+            logger.error(f"overdue recurring deeds were not returned, exception - {e}")
             return Response(1, e)
 
-    def get_max_id(self):
-        return self._get_max_value_of_column(self.table_model, 'id')
+    @db_executor
+    def _claim_notifications(self, deed_ids: list[int], now: datetime, session=None) -> list[int]:
+        table = self.table_model.__table__
+        command = (
+            update(table)
+            .where(table.c.id.in_(deed_ids))
+            .where(~table.c.done_flag)
+            .where(table.c.notify_time <= now)
+            .where(or_(table.c.notified_at.is_(None), table.c.notified_at != table.c.notify_time))
+            .values(notified_at=table.c.notify_time)
+        )
+        if session.get_bind().dialect.full_returning:
+            return session.execute(command.returning(table.c.id)).scalars().all()
+        return [deed_id for deed_id in deed_ids if session.execute(command.where(table.c.id == deed_id)).rowcount]
+
+    @db_timed
+    def claim_notifications(self, deed_ids: list[int], now: datetime, session=None) -> Response(int, list[int]):
+        """mark due notifications of undone deeds as delivered and return ids claimed by this call;
+        a notification is claimed once, so instances racing for it deliver it exactly once"""
+        try:
+            claimed_ids = self._claim_notifications(deed_ids, now, session=session)
+            logger.info(f"{len(claimed_ids)} of {len(deed_ids)} notifications were claimed")
+            return Response(0, claimed_ids)
+        except Exception as e:
+            logger.error(f"notifications of {len(deed_ids)} deeds were not claimed, exception - {e}")
+            return Response(1, e)
 
-    def add_notification(self, deed_id: int, notification_time: datetime) -> Response(int, str):
+    @db_timed
+    def add_notification(self, deed_id: int, notification_time: datetime, session=None) -> Response(int, str):
         filter_values = {
             'id': deed_id
         }
@@ -149,14 +279,15 @@ class DeedProcessor(TableProcessor):
             'notify_time': notification_time
         }
         try:
-            self._change_column_value(self.table_model, filter_values, change_values)
+            self._change_column_value(self.table_model, filter_values, change_values, session=session)
             logger.info(f"notification for {deed_id=} was set to {notification_time}")
             return Response(0, 'OK')
         except Exception as e:
             logger.error(f"notification for {deed_id=} was NOT set to {notification_time}, exception - {e}")
             return Response(1, e)
 
-    def mark_deed_as_done(self, deed_id: int) -> Response(int, str):
+    @db_timed
+    def mark_deed_as_done(self, deed_id: int, session=None) -> Response(int, str):
         filter_values = {
             'id': deed_id
         }
@@ -164,31 +295,85 @@ class DeedProcessor(TableProcessor):
             'done_flag': True
         }
         try:
-            self._change_column_value(self.table_model, filter_values, change_values)
+            self._change_column_value(self.table_model, filter_values, change_values, session=session)
             logger.info(f"{deed_id=} was marked as done")
             return Response(0, 'OK')
         except Exception as e:
             logger.error(f"{deed_id=} was NOT marked as done, exception - {e}")
             return Response(1, e)
 
-    def get_deeds_for_user(self, telegram_id: int) -> Response(int, list[Deed]):
+    @db_timed
+    def get_deeds_for_user(self, telegram_id: int, session=None) -> Response(int, list[Deed]):
         filter_values = {
             'telegram_id': telegram_id,
             'done_flag': False
         }
-        deeds = self._get_filtered_data(self.table_model, filter_values)
+        deeds = self._get_filtered_data(self.table_model, filter_values, session=session)
         logger.info(f"returned deeds for user - {telegram_id}")
         return Response(0, deeds)
 
-    def get_deed_by_id(self, deed_id: int) -> Response(int, Deed):
+    @db_timed
+    def get_deeds_page_for_user(self,
+                                telegram_id: int,
+                                after_id: int = None,
+                                before_id: int = None,
+                                limit: int = 10,
+                                session=None) -> Response(int, DeedsPage):
+        """undone deeds of user ordered by id, page starts after after_id or ends before before_id;
+        one extra row is fetched to know if there is a next page, so cost doesn't depend on list size"""
+        model = self.table_model
+        query = select(model).where(model.telegram_id == telegram_id).where(~model.done_flag)
+        if before_id is not None:
+            query = query.where(model.id < before_id).order_by(model.id.desc())
+        else:
+            if after_id is not None:
+                query = query.where(model.id > after_id)
+            query = query.order_by(model.id)
+
+        try:
+            deeds = self.get_query_result(query.limit(limit + 1), session=session)
+            has_more = len(deeds) > limit
+            deeds = deeds[:limit]
+            if before_id is not None:
+                deeds = deeds[::-1]
+                has_prev, has_next = has_more, True
+            else:
+                has_prev, has_next = after_id is not None, has_more
+
+            page = DeedsPage(
+                deeds=deeds,
+                prev_before_id=deeds[0].id if deeds and has_prev else None,
+                next_after_id=deeds[-1].id if deeds and has_next else None,
+            )
+            logger.info(f"returned deeds page for user - {telegram_id}, {after_id=}, {before_id=}")
+            return Response(0, page)
+        except Exception as e:
+            logger.error(f"deeds page for user - {telegram_id} was not returned, exception - {e}")
+            return Response(1, e)
+
+    @db_timed
+    def get_deeds_by_ids(self, deed_ids: list[int], session=None) -> Response(int, list[Deed]):
+        """deeds with any done_flag, missing ids are skipped"""
+        query = select(self.table_model).where(self.table_model.id.in_(deed_ids))
+        try:
+            deeds = self.get_query_result(query, session=session)
+            logger.info(f"returned {len(deeds)} deeds by ids")
+            return Response(0, deeds)
+        except Exception as e:
+            logger.error(f"deeds by ids were not returned, exception - {e}")
+            return Response(1, e)
+
+    @db_timed
+    def get_deed_by_id(self, deed_id: int, session=None) -> Response(int, Deed):
         filter_values = {
             'id': deed_id
         }
-        deed = self._get_filtered_data(self.table_model, filter_values)[0]
+        deed = self._get_filtered_data(self.table_model, filter_values, session=session)[0]
         logger.info(f"returned {deed_id=}")
         return Response(0, deed)
 
-    def rename_deed_name(self, deed_id: int, new_deed_name: str):
+    @db_timed
+    def rename_deed_name(self, deed_id: int, new_deed_name: str, session=None):
         filter_values = {
             'id': deed_id
         }
@@ -196,7 +381,7 @@ class DeedProcessor(TableProcessor):
             'name': new_deed_name
         }
         try:
-            self._change_column_value(self.table_model, filter_values, change_values)
+            self._change_column_value(self.table_model, filter_values, change_values, session=session)
             logger.info(f"{deed_id=} was renamed to {new_deed_name}")
             return Response(0, 'OK')
         except Exception as e:
@@ -204,28 +389,361 @@ class DeedProcessor(TableProcessor):
             return Response(1, e)
 
 
+    @db_timed
+    def insert_deeds(self, deed_names: list[str], telegram_id: int, session=None) -> Response(int, list[int]):
+        create_time = datetime.now()
+        data = [
+            {
+                'telegram_id': telegram_id,
+                'name': deed_name,
+                'create_time': create_time,
+                'notify_time': None,
+                'done_flag': False,
+            }
+            for deed_name in deed_names
+        ]
+        try:
+            deed_ids = self._insert_many_values(self.table_model, data, session=session)
+            logger.info(f"{len(deed_ids)} deeds of user {telegram_id} were inserted to DB")
+            return Response(0, deed_ids)
+        except Exception as e:
+            logger.error(f"{len(deed_names)} deeds of user {telegram_id} were not inserted to DB, exception - {e}")
+            return Response(1, e)
+
+    @db_timed
+    def add_notifications(self, notifications: dict[int, datetime], recurrence: str = None,
+                          session=None) -> Response(int, str):
+        """notifications is mapping deed_id -> notification_time, recurrence rule is replaced for all of them"""
+        change_values = {
+            'recurrence': recurrence
+        }
+        try:
+            self._change_column_value_by_key(self.table_model, 'id', 'notify_time', notifications, change_values,
+                                             session=session)
+            logger.info(f"notifications for {len(notifications)} deeds were set, {recurrence=}")
+            return Response(0, 'OK')
+        except Exception as e:
+            logger.error(f"notifications for {len(notifications)} deeds were NOT set, exception - {e}")
+            return Response(1, e)
+
+    @db_timed
+    def advance_notifications(self, notifications: dict[int, datetime], session=None) -> Response(int, str):
+        """move recurring deeds to their next occurrences, recurrence rule is kept"""
+        try:
+            self._change_column_value_by_key(self.table_model, 'id', 'notify_time', notifications, session=session)
+            logger.info(f"notifications of {len(notifications)} recurring deeds were advanced")
+            return Response(0, 'OK')
+        except Exception as e:
+            logger.error(f"notifications of {len(notifications)} recurring deeds were NOT advanced, exception - {e}")
+            return Response(1, e)
+
+    @db_timed
+    def mark_deeds_as_done(self, deed_ids: list[int], session=None) -> Response(int, str):
+        change_values = {
+            'done_flag': True
+        }
+        try:
+            self._change_column_value_for_keys(self.table_model, 'id', deed_ids, change_values, session=session)
+            logger.info(f"{len(deed_ids)} deeds were marked as done")
+            return Response(0, 'OK')
+        except Exception as e:
+            logger.error(f"{len(deed_ids)} deeds were NOT marked as done, exception - {e}")
+            return Response(1, e)
+
+    @db_timed
+    def rename_deeds(self, new_deed_names: dict[int, str], session=None) -> Response(int, str):
+        """new_deed_names is mapping deed_id -> new name"""
+        try:
+            self._change_column_value_by_key(self.table_model, 'id', 'name', new_deed_names, session=session)
+            logger.info(f"{len(new_deed_names)} deeds were renamed")
+            return Response(0, 'OK')
+        except Exception as e:
+            logger.error(f"{len(new_deed_names)} deeds were NOT renamed, exception - {e}")
+            return Response(1, e)
+
+
 class Backend:
 
-    def __init__(self, engine):
+    def __init__(self, engine, cache_size: int = 10000, cache_ttl: float = 300):
         self.deed_processor = DeedProcessor(engine)
+        self.cache = DeedCache(cache_size, cache_ttl)
+
+    def add_deed(self, deed_name: str, telegram_id: int, notify_time: datetime = None) -> Response:
+        response = self.deed_processor.insert_deed(deed_name, telegram_id, notify_time)
+        self.cache.invalidate_user(telegram_id)
+        return response
 
-    def add_deed(self, deed_name: str, telegram_id: int) -> Response:
-        return self.deed_processor.insert_deed(deed_name, telegram_id)
+    def get_active_deeds(self, since: datetime, until: datetime = None, batch_size: int = 1000,
+                         num_shards: int = 0, shards: Iterable[int] = None, undelivered_only: bool = False
+                         ) -> Response:
+        return self.deed_processor.get_all_active_deeds(since, until, batch_size, num_shards, shards,
+                                                        undelivered_only)
 
-    def get_active_deeds(self) -> Response:
-        return self.deed_processor.get_all_active_deeds()
+    def claim_notifications(self, deed_ids: list[int], now: datetime) -> Response:
+        return self.deed_processor.claim_notifications(deed_ids, now)
 
     def add_notification(self, deed_id: int, notification_time: datetime) -> Response:
-        return self.deed_processor.add_notification(deed_id, notification_time)
+        response = self.deed_processor.add_notification(deed_id, notification_time)
+        self.cache.invalidate_deed(deed_id)
+        return response
 
     def mark_deed_as_done(self, deed_id: int) -> Response:
-        return self.deed_processor.mark_deed_as_done(deed_id)
+        response = self.deed_processor.mark_deed_as_done(deed_id)
+        self.cache.invalidate_deed(deed_id)
+        return response
 
     def rename_deed(self, deed_id: int, new_deed_name: str) -> Response:
-        return self.deed_processor.rename_deed_name(deed_id, new_deed_name)
+        response = self.deed_processor.rename_deed_name(deed_id, new_deed_name)
+        self.cache.invalidate_deed(deed_id)
+        return response
 
     def get_deed_for_user(self, telegram_id: int) -> Response:
-        return self.deed_processor.get_deeds_for_user(telegram_id)
+        deeds = self.cache.get_user_deeds(telegram_id, 'all')
+        if deeds is not None:
+            return Response(0, deeds)
+
+        generation = self.cache.generation
+        response = self.deed_processor.get_deeds_for_user(telegram_id)
+        if not response.status:
+            self.cache.set_user_deeds(telegram_id, 'all', response.answer, response.answer, generation)
+        return response
+
+    def get_deeds_page_for_user(self, telegram_id: int, after_id: int = None, before_id: int = None,
+                                limit: int = 10) -> Response:
+        page_key = (after_id, before_id, limit)
+        page = self.cache.get_user_deeds(telegram_id, page_key)
+        if page is not None:
+            return Response(0, page)
+
+        generation = self.cache.generation
+        response = self.deed_processor.get_deeds_page_for_user(telegram_id, after_id, before_id, limit)
+        if not response.status:
+            self.cache.set_user_deeds(telegram_id, page_key, response.answer, response.answer.deeds, generation)
+        return response
 
     def get_deed(self, deed_id) -> Response:
-        return self.deed_processor.get_deed_by_id(deed_id)
+        deed = self.cache.deeds.get(deed_id)
+        if deed is not None:
+            return Response(0, deed)
+
+        generation = self.cache.generation
+        response = self.deed_processor.get_deed_by_id(deed_id)
+        if not response.status:
+            self.cache.set_deed(response.answer, generation)
+        return response
+
+    def get_deeds(self, deed_ids: list[int]) -> Response:
+        """cached deeds plus one query for the rest"""
+        deeds = []
+        missing_ids = []
+        for deed_id in deed_ids:
+            deed = self.cache.deeds.get(deed_id)
+            if deed is None:
+                missing_ids.append(deed_id)
+            else:
+                deeds.append(deed)
+        if not missing_ids:
+            return Response(0, deeds)
+
+        generation = self.cache.generation
+        response = self.deed_processor.get_deeds_by_ids(missing_ids)
+        if response.status:
+            return response
+        for deed in response.answer:
+            self.cache.set_deed(deed, generation)
+        return Response(0, deeds + response.answer)
+
+    def add_deeds(self, deed_names: list[str], telegram_id: int) -> Response:
+        response = self.deed_processor.insert_deeds(deed_names, telegram_id)
+        self.cache.invalidate_user(telegram_id)
+        return response
+
+    def add_notifications(self, notifications: dict[int, datetime], recurrence: str = None) -> Response:
+        response = self.deed_processor.add_notifications(notifications, recurrence)
+        self.cache.invalidate_deeds(notifications)
+        return response
+
+    def get_overdue_recurring_deeds(self, before: datetime) -> Response:
+        return self.deed_processor.get_overdue_recurring_deeds(before)
+
+    def advance_notifications(self, notifications: dict[int, datetime]) -> Response:
+        response = self.deed_processor.advance_notifications(notifications)
+        self.cache.invalidate_deeds(notifications)
+        return response
+
+    def mark_deeds_as_done(self, deed_ids: list[int]) -> Response:
+        response = self.deed_processor.mark_deeds_as_done(deed_ids)
+        self.cache.invalidate_deeds(deed_ids)
+        return response
+
+    def rename_deeds(self, new_deed_names: dict[int, str]) -> Response:
+        response = self.deed_processor.rename_deeds(new_deed_names)
+        self.cache.invalidate_deeds(new_deed_names)
+        return response
+
+
+class AsyncBackend:
+    """awaitable facade of Backend, every call is executed in a bounded thread pool
+    so slow queries don't block the event loop of the bot"""
+
+    def __init__(self, engine, max_workers: int = 8, cache_size: int = 10000, cache_ttl: float = 300):
+        self.backend = Backend(engine, cache_size, cache_ttl)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='backend')
+
+    async def _run(self, method, *args) -> Response:
+        return await run_in_executor(self.executor, method, *args)
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=True)
+
+    async def add_deed(self, deed_name: str, telegram_id: int, notify_time: datetime = None) -> Response:
+        return await self._run(self.backend.add_deed, deed_name, telegram_id, notify_time)
+
+    async def get_active_deeds(self, since: datetime, until: datetime = None, batch_size: int = 1000,
+                               num_shards: int = 0, shards: Iterable[int] = None, undelivered_only: bool = False
+                               ) -> Response:
+        """answer is async iterator over batches, every batch is fetched in the thread pool"""
+        response = self.backend.get_active_deeds(since, until, batch_size, num_shards, shards, undelivered_only)
+        if response.status:
+            return response
+        return Response(0, self._iterate_in_executor(response.answer))
+
+    async def _iterate_in_executor(self, iterator: Iterator) -> AsyncIterator:
+        """session and cursor of a stream are bound to the thread which opened them,
+        so every stream is consumed in its own single thread executor"""
+        loop = asyncio.get_running_loop()
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix='backend-stream') as stream_executor:
+            while (item := await loop.run_in_executor(stream_executor, next, iterator, None)) is not None:
+                yield item
+
+    async def claim_notifications(self, deed_ids: list[int], now: datetime) -> Response:
+        return await self._run(self.backend.claim_notifications, deed_ids, now)
+
+    async def add_notification(self, deed_id: int, notification_time: datetime) -> Response:
+        return await self._run(self.backend.add_notification, deed_id, notification_time)
+
+    async def mark_deed_as_done(self, deed_id: int) -> Response:
+        return await self._run(self.backend.mark_deed_as_done, deed_id)
+
+    async def rename_deed(self, deed_id: int, new_deed_name: str) -> Response:
+        return await self._run(self.backend.rename_deed, deed_id, new_deed_name)
+
+    async def get_deed_for_user(self, telegram_id: int) -> Response:
+        return await self._run(self.backend.get_deed_for_user, telegram_id)
+
+    async def get_deeds_page_for_user(self, telegram_id: int, after_id: int = None, before_id: int = None,
+                                      limit: int = 10) -> Response:
+        return await self._run(self.backend.get_deeds_page_for_user, telegram_id, after_id, before_id, limit)
+
+    async def get_deed(self, deed_id) -> Response:
+        return await self._run(self.backend.get_deed, deed_id)
+
+    async def get_deeds(self, deed_ids: list[int]) -> Response:
+        return await self._run(self.backend.get_deeds, deed_ids)
+
+    async def add_deeds(self, deed_names: list[str], telegram_id: int) -> Response:
+        return await self._run(self.backend.add_deeds, deed_names, telegram_id)
+
+    async def add_notifications(self, notifications: dict[int, datetime], recurrence: str = None) -> Response:
+        return await self._run(self.backend.add_notifications, notifications, recurrence)
+
+    async def get_overdue_recurring_deeds(self, before: datetime) -> Response:
+        return await self._run(self.backend.get_overdue_recurring_deeds, before)
+
+    async def advance_notifications(self, notifications: dict[int, datetime]) -> Response:
+        return await self._run(self.backend.advance_notifications, notifications)
+
+    async def mark_deeds_as_done(self, deed_ids: list[int]) -> Response:
+        return await self._run(self.backend.mark_deeds_as_done, deed_ids)
+
+    async def rename_deeds(self, new_deed_names: dict[int, str]) -> Response:
+        return await self._run(self.backend.rename_deeds, new_deed_names)
+
+
+class BatchLoader(ABC):
+    """collects keys requested during one tick and resolves them with one backend call,
+    so notifications firing at the same time don't make a query each"""
+
+    # all waiters of a key get its value, otherwise only the first one does and the rest get None
+    share_results = True
+
+    def __init__(self, backend: AsyncBackend, delay: float = 0.01, max_batch: int = 1000):
+        self.backend = backend
+        self.delay = delay
+        self.max_batch = max_batch
+        self._pending: dict[Hashable, list[asyncio.Future]] = {}
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._tasks: set[asyncio.Task] = set()
+
+    @abstractmethod
+    async def _load_many(self, keys: list) -> Response:
+        """answer is mapping key -> value, keys missing there are resolved with None"""
+
+    async def load(self, key: Hashable) -> Any:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.setdefault(key, []).append(future)
+
+        if len(self._pending) >= self.max_batch:
+            self._flush_pending()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.delay, self._flush_pending)
+        return await future
+
+    def _flush_pending(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        pending, self._pending = self._pending, {}
+        task = asyncio.get_running_loop().create_task(self._flush(pending))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _flush(self, pending: dict[Hashable, list[asyncio.Future]]) -> None:
+        try:
+            response = await self._load_many(list(pending))
+        except asyncio.CancelledError:
+            for futures in pending.values():
+                for future in futures:
+                    future.cancel()
+            raise
+        except Exception as e:
+            # e.g. executor is already shut down, waiters get the error instead of hanging
+            logger.error(f"batch of {len(pending)} keys was not loaded, exception - {e}")
+            response = Response(1, e)
+        for key, futures in pending.items():
+            value = None if response.status else response.answer.get(key)
+            for future in futures:
+                if future.done():
+                    continue
+                if response.status:
+                    future.set_exception(response.answer)
+                else:
+                    future.set_result(value)
+                    if not self.share_results:
+                        value = None
+
+
+class DeedLoader(BatchLoader):
+    """loads deeds requested during one tick with one WHERE id IN (...) query, load returns deed or None
+    if it doesn't exist"""
+
+    async def _load_many(self, deed_ids: list[int]) -> Response:
+        response = await self.backend.get_deeds(deed_ids)
+        if response.status:
+            return response
+        return Response(0, {deed.id: deed for deed in response.answer})
+
+
+class NotificationClaimer(BatchLoader):
+    """claims due notifications of deeds requested during one tick with one UPDATE,
+    load returns True if this instance has to deliver the notification"""
+
+    # the deed fired twice in the instance, e.g. a sweep scheduled it again, only one delivery wins the claim
+    share_results = False
+
+    async def _load_many(self, deed_ids: list[int]) -> Response:
+        response = await self.backend.claim_notifications(deed_ids, datetime.now().astimezone())
+        if response.status:
+            return response
+        return Response(0, {deed_id: True for deed_id in response.answer})
@@ -0,0 +1,131 @@
+"""Bounded in-process caches of backend reads.
+
+The cache is local to one process: with several bot instances writes of one instance can't invalidate
+the others, so it must be turned off there (maxsize=0).
+"""
+from collections import OrderedDict
+from typing import Any, Hashable, Iterable
+import threading
+import time
+
+from lib.metrics import registry
+
+cache_requests = registry.counter('backend_cache_requests_total', 'backend cache lookups by cache and result')
+
+_MISSING = object()
+
+
+class LRUCache:
+    """least recently used cache with time to live of entries, maxsize=0 turns it off"""
+
+    def __init__(self, name: str, maxsize: int, ttl: float):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING and entry[0] < time.monotonic():
+                del self._data[key]
+                entry = _MISSING
+            if entry is _MISSING:
+                cache_requests.inc(cache=self.name, result='miss')
+                return default
+            self._data.move_to_end(key)
+        cache_requests.inc(cache=self.name, result='hit')
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        if not self.maxsize:
+            return None
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.pop(key, _MISSING)
+        return default if entry is _MISSING else entry[1]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    @property
+    def hits(self) -> float:
+        return cache_requests.value(cache=self.name, result='hit')
+
+    @property
+    def misses(self) -> float:
+        return cache_requests.value(cache=self.name, result='miss')
+
+
+class DeedCache:
+    """deeds by id and pages of undone deeds by telegram_id
+
+    Every invalidation bumps generation. Read-through callers take generation before the query and store
+    the result only if it didn't change, so a read which raced with a write can't cache stale data.
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 300):
+        self.deeds = LRUCache('deed', maxsize, ttl)
+        # telegram_id -> {page key -> cached list or page}, so a write drops all pages of the user at once
+        self.user_deeds = LRUCache('user_deeds', maxsize, ttl)
+        self.generation = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.deeds.maxsize)
+
+    def _bump_generation(self) -> None:
+        with self._lock:
+            self.generation += 1
+
+    def set_deed(self, deed: 'Deed', generation: int) -> None:
+        if generation == self.generation:
+            self.deeds.set(deed.id, deed)
+
+    def get_user_deeds(self, telegram_id: int, page_key: Hashable) -> Any:
+        pages = self.user_deeds.get(telegram_id)
+        if pages is None:
+            return None
+        return pages.get(page_key)
+
+    def set_user_deeds(self, telegram_id: int, page_key: Hashable, value: Any, deeds: list['Deed'],
+                       generation: int) -> None:
+        if not self.enabled or generation != self.generation:
+            return None
+        with self._lock:
+            pages = self.user_deeds.get(telegram_id)
+            if pages is None:
+                pages = {}
+                self.user_deeds.set(telegram_id, pages)
+            pages[page_key] = value
+        for deed in deeds:
+            self.deeds.set(deed.id, deed)
+
+    def invalidate_user(self, telegram_id: int) -> None:
+        self._bump_generation()
+        self.user_deeds.pop(telegram_id)
+
+    def invalidate_deed(self, deed_id: int) -> None:
+        self.invalidate_deeds([deed_id])
+
+    def invalidate_deeds(self, deed_ids: Iterable[int]) -> None:
+        """owners are taken from the cached deeds, if any is unknown all deed lists are dropped"""
+        self._bump_generation()
+        deeds = [self.deeds.pop(deed_id) for deed_id in deed_ids]
+        if None in deeds:
+            self.user_deeds.clear()
+            return None
+        for telegram_id in {deed.telegram_id for deed in deeds}:
+            self.user_deeds.pop(telegram_id)
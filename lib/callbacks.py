@@ -0,0 +1,133 @@
+"""Compact callback_data of inline buttons and routing of callback queries to their handlers.
+
+Buttons carry a one letter opcode followed by ints packed in base 36 and separated by dots, e.g. `d2` is
+the day after tomorrow and `D2n9c` is the deed 123456. A state has one CallbackQueryHandler whose pattern
+decodes the data once, the handler of the opcode is then found in a dict and called with the ints.
+Buttons sent in the old `name=value` format are still in chats, they decode to the same callbacks.
+"""
+from string import digits, ascii_lowercase
+from typing import Awaitable, Callable, NamedTuple, Optional
+from telegram import Update
+from telegram.ext import CallbackQueryHandler, ContextTypes
+
+import lib.recurrence as rec
+
+DEED = 'D'
+DEEDS_BEFORE = 'B'
+DEEDS_AFTER = 'A'
+TIMER = 'T'
+RENAME = 'R'
+DONE = 'X'
+NOTIFY_TIMER = 't'
+NOTIFY_DONE = 'x'
+DAY = 'd'
+REPEAT = 'r'
+HOUR = 'h'
+MINUTE = 'm'
+POSTPONE = 'p'
+DZYN = 'z'
+
+_legacy_ops = {
+    'deed_id': DEED,
+    'deeds_before': DEEDS_BEFORE,
+    'deeds_after': DEEDS_AFTER,
+    'timer_deed_id': TIMER,
+    'rename_deed_id': RENAME,
+    'done_deed_id': DONE,
+    'notify_timer_deed_id': NOTIFY_TIMER,
+    'notify_done_deed_id': NOTIFY_DONE,
+    'day': DAY,
+    'repeat': REPEAT,
+    'hour': HOUR,
+    'minute': MINUTE,
+    'postpone': POSTPONE,
+    'dzyn': DZYN,
+}
+
+# numbers of args the handlers of opcodes take
+_arities = {op: (1,) for op in _legacy_ops.values()}
+_arities[REPEAT] = (0, 1)
+_arities[DZYN] = (0,)
+
+_alphabet = digits + ascii_lowercase
+
+Handler = Callable[..., Awaitable[Optional[int]]]
+
+
+class Callback(NamedTuple):
+    op: str
+    args: tuple[int, ...]
+
+
+def pack_int(value: int) -> str:
+    if value < 0:
+        return '-' + pack_int(-value)
+    packed = ''
+    while True:
+        value, digit = divmod(value, 36)
+        packed = _alphabet[digit] + packed
+        if not value:
+            return packed
+
+
+def encode(op: str, *args: int) -> str:
+    return op + '.'.join(pack_int(arg) for arg in args)
+
+
+def encode_repeat(recurrence: Optional[str]) -> str:
+    """rule is stored as its index in RECURRENCES, no args switch repetition off"""
+    if recurrence is None:
+        return encode(REPEAT)
+    return encode(REPEAT, rec.RECURRENCES.index(recurrence))
+
+
+def _parse_op(data: str) -> tuple[Optional[str], str, bool]:
+    """opcode, packed args and whether data is in the old format"""
+    if '=' in data or data == 'dzyn':
+        name, _, value = data.partition('=')
+        return _legacy_ops.get(name), value, True
+    return data[:1], data[1:], False
+
+
+def _parse_args(op: str, value: str, legacy: bool) -> tuple[int, ...]:
+    if not value:
+        return ()
+    if legacy:
+        if op == REPEAT:
+            return (rec.RECURRENCES.index(value),) if value in rec.RECURRENCES else ()
+        return int(value),
+    return tuple(int(arg, 36) for arg in value.split('.'))
+
+
+def decode(data: object, ops=None) -> Optional[Callback]:
+    """None for data which is not a callback of ops, args are parsed only for known opcodes"""
+    if not isinstance(data, str) or not data:
+        return None
+    op, value, legacy = _parse_op(data)
+    if op not in _arities or (ops is not None and op not in ops):
+        return None
+    try:
+        args = _parse_args(op, value, legacy)
+    except ValueError:
+        return None
+    if len(args) not in _arities[op]:
+        return None
+    return Callback(op, args)
+
+
+class CallbackRouter:
+    """one CallbackQueryHandler for a set of opcodes, handlers are called with the args of the callback"""
+
+    def __init__(self, routes: dict[str, Handler]):
+        self.routes = routes
+
+    def match(self, data: object) -> Optional[Callback]:
+        return decode(data, self.routes)
+
+    async def route(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> Optional[int]:
+        # result of the pattern is passed over in context.matches
+        callback = context.matches[0]
+        return await self.routes[callback.op](update, context, *callback.args)
+
+    def handler(self) -> CallbackQueryHandler:
+        return CallbackQueryHandler(self.route, pattern=self.match)
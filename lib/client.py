@@ -1,27 +1,52 @@
+import asyncio
 import logging
-from telegram import ReplyKeyboardRemove, Update, CallbackQuery
+import time
+from telegram import Bot, ReplyKeyboardRemove, Update, CallbackQuery
 from telegram.ext import (
     Application,
     CommandHandler,
     ContextTypes,
     ConversationHandler,
-    CallbackQueryHandler,
     MessageHandler,
     filters
 )
 from dataclasses import dataclass
+from functools import partial
 from datetime import datetime, timedelta
+from typing import Awaitable, Iterable, Optional
+from urllib.parse import urlparse
 
 import utils.utils as ut
 import lib.print_functions as pf
 import lib.keyboards as kb
-from lib.backend import Backend
+import lib.callbacks as cb
+import lib.recurrence as rec
+import lib.quick_add as quick_add
+from lib.application import ChatOrderedApplication
+from lib.backend import AsyncBackend, DeedLoader, NotificationClaimer
+from lib.dispatcher import NotificationDispatcher
+from lib.scheduler import JobQueueScheduler, HeapScheduler
+from lib.sharding import ShardOwnership
+from lib.persistence import DbPersistence
+from lib.metrics import registry, serve, timed
 
 menu_names = ut.get_menu_names()
 
 # Enable logging
 logger = logging.getLogger(__name__)
 
+handler_time = registry.histogram('handler_seconds', 'time of update handlers and jobs by handler')
+handler_errors = registry.counter('handler_errors_total', 'exceptions raised by update handlers and jobs by handler')
+scheduled_notifications = registry.gauge('notification_jobs_scheduled', 'notifications scheduled in memory')
+notification_lag = registry.histogram('notification_lag_seconds', 'time from notify_time of a deed to its sent message',
+                                      buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 3600.0))
+
+
+def timed_handler(handler):
+    """handler observed in handler_seconds under its method name, partials are named by their function"""
+    name = getattr(handler, '__name__', None) or handler.func.__name__
+    return timed(handler_time, handler_errors, handler=name)(handler)
+
 
 class Client:
 
@@ -33,28 +58,92 @@ class Client:
         PROCESS_NOTIFICATION_TIME: int
         PROCESS_RENAME_DEED_NAME: int
         PROCESS_TIME: int
-
-    def __init__(self, token: str, engine):
-        self.backend = Backend(engine)
-        self.application = Application.builder().token(token).build()
+        PROCESS_DONE_ALL_CONFIRMATION: int
+        PROCESS_DEED_NAMES: int
+
+    def __init__(self,
+                 token: str,
+                 engine,
+                 db_workers: int = 8,
+                 metrics_dump_interval: int = 60,
+                 metrics_port: int = 0,
+                 cache_size: int = 10000,
+                 cache_ttl: float = 300,
+                 deeds_page_size: int = 10,
+                 notification_window: timedelta = timedelta(hours=1),
+                 notification_rate: float = 30,
+                 notification_chat_interval: float = 1.0,
+                 scheduler_engine: str = 'job_queue',
+                 notification_shards: int = 0,
+                 shard_lease_ttl: float = 30,
+                 instance_id: str = None,
+                 concurrent_chats: int = 64,
+                 persistence_interval: float = 5,
+                 bot: Bot = None):
+        if notification_shards and cache_size:
+            # other instances can't invalidate it, deeds done or renamed there would be notified stale here
+            logger.warning('deed cache is turned off, it is not shared between instances of notification shards')
+            cache_size = 0
+        self.backend = AsyncBackend(engine, max_workers=db_workers, cache_size=cache_size, cache_ttl=cache_ttl)
+        self.deed_loader = DeedLoader(self.backend)
+        self.dispatcher = NotificationDispatcher(rate=notification_rate, per_chat_interval=notification_chat_interval)
+        builder = Application.builder()
+        # prebuilt bot is used by load tests, token is ignored then
+        builder = builder.bot(bot) if bot else builder.token(token)
+        if persistence_interval:
+            builder = builder.persistence(DbPersistence(engine, self.backend.executor, persistence_interval))
+        if concurrent_chats:
+            builder = builder.application_class(ChatOrderedApplication,
+                                                kwargs={'max_concurrent_chats': concurrent_chats})
+        self.application = (
+            builder
+            .post_init(self.post_init)
+            .post_shutdown(self.post_shutdown)
+            .build()
+        )
+        # deeds which left the scheduler and whose notification is not queued or skipped yet
+        self._firing: set[int] = set()
+        self._timed_notification = timed_handler(self.notification)
+        if scheduler_engine == 'heap':
+            self.scheduler = HeapScheduler(self.fire_notification)
+        else:
+            self.scheduler = JobQueueScheduler(self.application.job_queue, self.fire_notification)
+        scheduled_notifications.set_function(lambda: len(self.scheduler))
+        # with several instances every one loads notifications of its shards and claims each delivery
+        self.shards = None
+        self.notification_claimer = None
+        if notification_shards:
+            self.shards = ShardOwnership(engine, self.backend.executor, notification_shards, shard_lease_ttl,
+                                         instance_id)
+            self.notification_claimer = NotificationClaimer(self.backend)
+        self.metrics_dump_interval = metrics_dump_interval
+        # prometheus endpoint, started in post_init when the port is set
+        self.metrics_port = metrics_port
+        self.metrics_server = None
+        self.deeds_page_size = deeds_page_size
+        # only notifications due before window_end are kept as jobs, refill job moves the window forward
+        self.notification_window = notification_window
+        self.window_end = None
         self.states = self.get_states()
+        # answers of callback queries, the handlers don't wait for them
+        self._answers: set[asyncio.Task] = set()
         logger.info('engine was passed')
 
     def get_states(self):
-        states = self.States(*range(6))
+        states = self.States(*range(8))
         return states
 
-    @staticmethod
-    def reset_notification_job(name: str, context: ContextTypes.DEFAULT_TYPE) -> bool:
-        current_jobs = context.job_queue.get_jobs_by_name(name)
-        if not current_jobs:
-            logger.info(f"Job {name=} does not exist at jobs")
-            return False
-        logger.info(f"Job name =  {name}. Start to remove all jobs")
-        for job in current_jobs:
-            job.schedule_removal()
-            logger.info(f"Job {job=} removed")
-        return True
+    def answer_query(self, query: CallbackQuery) -> None:
+        """stops the spinner on the button in background, so the answer overlaps the work of the handler"""
+        task = asyncio.create_task(self._answer_query(query))
+        self._answers.add(task)
+        task.add_done_callback(self._answers.discard)
+
+    async def _answer_query(self, query: CallbackQuery) -> None:
+        try:
+            await query.answer()
+        except Exception as e:
+            logger.error(f"callback query {query.id} was not answered, exception - {e}")
 
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         markup = kb.get_start_keyboard()
@@ -67,9 +156,9 @@ class Client:
 
     async def show_deeds(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         user_id = update.message.from_user.id
-        response = self.backend.get_deed_for_user(user_id)
-        deeds = response.answer
-        markup = kb.get_inline_deeds(deeds)
+        response = await self.backend.get_deeds_page_for_user(user_id, limit=self.deeds_page_size)
+        page = response.answer
+        markup = kb.get_inline_deeds(page.deeds, page.prev_before_id, page.next_after_id)
         text = pf.this_is_deeds()
         await update.message.reply_text(
             text,
@@ -78,6 +167,24 @@ class Client:
 
         return self.states.MAIN_MENU_CHOSE
 
+    async def process_deeds_page_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE, cursor: int,
+                                          before: bool) -> int:
+        query = update.callback_query
+        self.answer_query(query)
+
+        user_id = query.from_user.id
+        if before:
+            response = await self.backend.get_deeds_page_for_user(user_id, before_id=cursor,
+                                                                  limit=self.deeds_page_size)
+        else:
+            response = await self.backend.get_deeds_page_for_user(user_id, after_id=cursor,
+                                                                  limit=self.deeds_page_size)
+        page = response.answer
+        markup = kb.get_inline_deeds(page.deeds, page.prev_before_id, page.next_after_id)
+        await query.edit_message_reply_markup(reply_markup=markup)
+
+        return self.states.MAIN_MENU_CHOSE
+
     async def add_deed(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
         text = pf.deed_name_questions()
@@ -88,15 +195,43 @@ class Client:
 
         return self.states.PROCESS_DEED_NAME
 
+    async def add_many_deeds(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+        """/add_many, deeds are sent in one message, one per line"""
+        await update.message.reply_text(
+            pf.deed_names_questions(),
+            reply_markup=ReplyKeyboardRemove()
+        )
+
+        return self.states.PROCESS_DEED_NAMES
+
     async def process_deed_name(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-        deed_name = update.message.text
         user_id = update.message.from_user.id
-        response = self.backend.add_deed(deed_name, user_id)
-        deed_id = response.answer
-        context.user_data['deed_id'] = deed_id
+        response = await self.backend.add_deed(update.message.text, user_id)
+        if response.status:
+            return await self.start(update, context)
+        text = f"{pf.deed_added()}\n\n{pf.notification_questions()}"
+        return await self.ask_notification(update, context, [response.answer], text)
+
+    async def process_deed_names(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+        # every line of the message is a separate deed
+        deed_names = [line.strip() for line in update.message.text.split('\n') if line.strip()]
+        if not deed_names:
+            return await self.start(update, context)
+        user_id = update.message.from_user.id
+        response = await self.backend.add_deeds(deed_names, user_id)
+        if response.status:
+            return await self.start(update, context)
+        deed_ids = response.answer
+        text = f"{pf.deed_added()}: {len(deed_ids)}\n\n{pf.notification_questions()}"
+        return await self.ask_notification(update, context, deed_ids, text)
+
+    async def ask_notification(self, update: Update, context: ContextTypes.DEFAULT_TYPE, deed_ids: list[int],
+                               text: str) -> int:
+        """the time chosen next is set for all added deeds"""
+        context.user_data['deed_ids'] = deed_ids
+        context.user_data.pop('recurrence', None)
 
         markup = kb.bool_variants()
-        text = f"{pf.deed_added()}\n\n{pf.notification_questions()}"
         await update.message.reply_text(
             text,
             reply_markup=markup
@@ -104,11 +239,41 @@ class Client:
 
         return self.states.PROCESS_NOTIFICATION_FACT
 
+    async def process_quick_reminder(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+        """message like "pay rent tomorrow 18:30" in main menu, see lib.quick_add"""
+        reminder = quick_add.parse(update.message.text, ut.localize(datetime.now()))
+        if reminder is None:
+            # time of the message can't be used, e.g. it has passed, the time is asked with buttons then
+            return await self.process_deed_name(update, context)
+        return await self.add_quick_reminder(update, context, reminder)
+
+    async def add_quick_reminder(self, update: Update, context: ContextTypes.DEFAULT_TYPE,
+                                 reminder: quick_add.QuickReminder) -> int:
+        """deed is inserted with its notification, without questions about the time"""
+        context.user_data.pop('deed_ids', None)
+        context.user_data.pop('recurrence', None)
+        user_id = update.message.from_user.id
+        response = await self.backend.add_deed(reminder.name, user_id, reminder.notify_time)
+        if response.status:
+            return await self.start(update, context)
+
+        deed_id = response.answer
+        if self.window_end and reminder.notify_time < self.window_end:
+            self.scheduler.schedule(deed_id, user_id, reminder.notify_time)
+            logger.info(f'add job: notification_time={reminder.notify_time}, {user_id=}, {deed_id=}')
+
+        notify_time = ut.repr_date(reminder.notify_time, time_=True)
+        await update.message.reply_text(
+            f"{reminder.name}\n{pf.notify_added()} {notify_time}",
+            reply_markup=kb.get_start_keyboard()
+        )
+        return self.states.MAIN_MENU_CHOSE
+
     async def process_notification_fact(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         text = update.message.text
 
         if text == menu_names.no_:
-            del context.user_data['deed_id']
+            del context.user_data['deed_ids']
             markup = kb.get_start_keyboard()
             await update.message.reply_text(
                 "Oк!",
@@ -127,11 +292,10 @@ class Client:
             )
             return self.states.MAIN_MENU_CHOSE
 
-    async def process_day_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    async def process_day_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE, day_timedelta: int):
         query = update.callback_query
-        await query.answer()
+        self.answer_query(query)
 
-        day_timedelta = int(query.data.split('=')[1])
         date = ut.localize(datetime.now() + timedelta(days=day_timedelta))
 
         context.user_data['date'] = date
@@ -142,13 +306,26 @@ class Client:
 
         return self.states.MAIN_MENU_CHOSE
 
-    async def process_hour_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    async def process_repeat_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE,
+                                      recurrence_ix: int = None):
+        query = update.callback_query
+        self.answer_query(query)
+
+        recurrence = None
+        if recurrence_ix is not None and 0 <= recurrence_ix < len(rec.RECURRENCES):
+            recurrence = rec.RECURRENCES[recurrence_ix]
+        context.user_data['recurrence'] = recurrence
+        markup = kb.get_days(recurrence)
+        await query.edit_message_reply_markup(reply_markup=markup)
+
+        return self.states.MAIN_MENU_CHOSE
+
+    async def process_hour_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE, hour: int):
         query = update.callback_query
         ex_text = query.message.text
         ex_text = ex_text.split('\n')[0]
-        await query.answer()
+        self.answer_query(query)
 
-        hour = int(query.data.split('=')[1])
         context.user_data['hour'] = hour
         markup = kb.get_minutes()
         text = f"{ex_text},{hour}\n{pf.chose_minute()}:"
@@ -157,43 +334,55 @@ class Client:
         return self.states.MAIN_MENU_CHOSE
 
     async def make_job(self,
-                       deed_id: int,
+                       deed_ids: list[int],
                        user_id: int,
                        notification_time: datetime,
                        query: CallbackQuery,
                        context: ContextTypes.DEFAULT_TYPE) -> None:
 
-        self.reset_notification_job(name=str(deed_id), context=context)
-        context.job_queue.run_once(self.notification, when=notification_time, user_id=user_id,
-                                   data=str(deed_id), name=str(deed_id))
-        logger.info(f'add job: {notification_time=}, {user_id=}, {deed_id=}')
-
-        # localized_notification_time = ut.localize(notification_time)
-        response = self.backend.add_notification(deed_id, notification_time)
+        recurrence = context.user_data.pop('recurrence', None)
 
-        markup = kb.dzyn_keyboard()
-        text = pf.wow()
-        await query.edit_message_text(text=text, reply_markup=markup)
-
-        markup = kb.get_start_keyboard()
         text = f"{pf.notify_added()} {ut.repr_date(notification_time, time_=True)}"
-        await query.message.reply_text(
-            text,
-            reply_markup=markup
+        if recurrence:
+            text += f" 🔁 {kb.recurrence_names[recurrence]}"
+        # the edit and the reply don't depend on each other nor on the write, all three go at once;
+        # reply keyboard can't be attached to an edited message, so the reply stays a separate message
+        await asyncio.gather(
+            self.store_notifications(deed_ids, user_id, notification_time, recurrence),
+            query.edit_message_text(text=pf.wow(), reply_markup=kb.dzyn_keyboard()),
+            query.message.reply_text(text, reply_markup=kb.get_start_keyboard()),
         )
 
-    async def process_minute_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    async def store_notifications(self, deed_ids: list[int], user_id: int, notification_time: datetime,
+                                  recurrence: Optional[str]) -> None:
+        """the window is checked only after the write: a refill which moved the window meanwhile either read the
+        new time or left it before window_end, where only the job scheduled here fires it"""
+        response = await self.backend.add_notifications({deed_id: notification_time for deed_id in deed_ids},
+                                                        recurrence)
+        if response.status:
+            return None
+        for deed_id in deed_ids:
+            # later notifications are picked up from db by refill_notifications
+            if self.window_end and notification_time < self.window_end:
+                self.scheduler.schedule(deed_id, user_id, notification_time)
+                logger.info(f'add job: {notification_time=}, {user_id=}, {deed_id=}')
+            else:
+                self.scheduler.cancel(deed_id)
+
+    async def process_minute_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE, minute: int) -> int:
         query = update.callback_query
-        await query.answer()
+        self.answer_query(query)
+
+        if not {'date', 'hour', 'deed_ids'} <= context.user_data.keys():
+            return await self.flow_expired(query)
 
-        minute = int(query.data.split('=')[1])
         date = context.user_data['date']
         hour = context.user_data['hour']
 
         notification_time = date.replace(hour=hour, minute=minute, second=0)
 
         if notification_time < ut.localize(datetime.now()):
-            markup = kb.get_days()
+            markup = kb.get_days(context.user_data.get('recurrence'))
             text = pf.time_passed()
             await query.edit_message_text(text=text, reply_markup=markup)
             return self.states.MAIN_MENU_CHOSE
@@ -201,51 +390,105 @@ class Client:
         del context.user_data['date']
         del context.user_data['hour']
 
-        deed_id = context.user_data['deed_id']
-        del context.user_data['deed_id']
+        deed_ids = context.user_data['deed_ids']
+        del context.user_data['deed_ids']
 
         user_id = query.from_user.id
-        await self.make_job(deed_id, user_id, notification_time, query, context)
+        await self.make_job(deed_ids, user_id, notification_time, query, context)
 
         return self.states.MAIN_MENU_CHOSE
 
-    async def process_postpone_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    async def flow_expired(self, query: CallbackQuery) -> int:
+        """keyboard of a flow whose data was lost, e.g. sent before a restart without persistence"""
+        await asyncio.gather(
+            query.edit_message_text(text=pf.chose_move()),
+            query.message.reply_text(pf.chose_move(), reply_markup=kb.get_start_keyboard()),
+        )
+        return self.states.MAIN_MENU_CHOSE
+
+    async def process_postpone_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE, minutes: int) -> int:
         query = update.callback_query
-        await query.answer()
+        self.answer_query(query)
+
+        if 'deed_ids' not in context.user_data:
+            return await self.flow_expired(query)
 
-        minutes = int(query.data.split('=')[1])
         notification_time = ut.localize(datetime.now()) + timedelta(minutes=minutes)
 
-        deed_id = context.user_data['deed_id']
-        del context.user_data['deed_id']
+        deed_ids = context.user_data['deed_ids']
+        del context.user_data['deed_ids']
 
         user_id = query.from_user.id
-        await self.make_job(deed_id, user_id, notification_time, query, context)
+        await self.make_job(deed_ids, user_id, notification_time, query, context)
 
         return self.states.MAIN_MENU_CHOSE
 
-    async def notification(self, context: ContextTypes.DEFAULT_TYPE) -> None:
-
-        job = context.job
-        deed_id = int(job.data)
-        response = self.backend.get_deed(deed_id)
-        deed = response.answer
+    def fire_notification(self, deed_id: int, user_id: int) -> Awaitable[None]:
+        """callback of the scheduler, the deed is marked in flight before the notification task starts,
+        so loading notifications meanwhile doesn't schedule it again"""
+        self._firing.add(deed_id)
+        return self._fire_notification(deed_id, user_id)
+
+    async def _fire_notification(self, deed_id: int, user_id: int) -> None:
+        try:
+            await self._timed_notification(deed_id, user_id)
+        finally:
+            self._firing.discard(deed_id)
+
+    async def notification(self, deed_id: int, user_id: int) -> None:
+
+        # deeds of notifications firing in the same tick are loaded with one query,
+        # the deed is read at fire time so renames and completions made since scheduling are respected
+        deed = await self.deed_loader.load(deed_id)
+        if deed is None or deed.done_flag:
+            logger.info(f"notification skipped, {deed_id=} is done or deleted")
+            return None
+        # a refill could schedule the time the deed had before it was moved, the deed is notified at its new time;
+        # a second of slack as jobs may fire a moment early
+        notify_time = ut.localize(deed.notify_time) if deed.notify_time else None
+        if notify_time is None or notify_time > ut.localize(datetime.now()) + timedelta(seconds=1):
+            logger.info(f"notification skipped, {deed_id=} was moved to {notify_time}")
+            return None
+        if self.notification_claimer and not await self.notification_claimer.load(deed_id):
+            logger.info(f"notification skipped, {deed_id=} was delivered by another instance or moved")
+            return None
         markup = kb.get_inline_deed_after_notify(deed)
-        await context.bot.send_message(job.user_id, text=f"🔔 {deed.name}", reply_markup=markup)
-        logger.info(f"notification sent {job.user_id=}, {deed.name=}, {deed_id=}")
-
-    async def process_deed_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        notify_timestamp = notify_time.timestamp()
+        self.dispatcher.enqueue(user_id, text=f"🔔 {deed.name}", reply_markup=markup,
+                                on_sent=lambda message: notification_lag.observe(time.time() - notify_timestamp))
+        logger.info(f"notification queued {user_id=}, {deed.name=}, {deed_id=}")
+
+        if deed.recurrence:
+            await self.schedule_next_occurrence(deed)
+
+    async def schedule_next_occurrence(self, deed: 'Deed') -> None:
+        """only the next occurrence of a recurring deed is stored and scheduled"""
+        if not rec.is_valid(deed.recurrence):
+            logger.error(f"unknown recurrence {deed.recurrence!r} of deed_id={deed.id}")
+            return None
+        now = ut.localize(datetime.now())
+        notify_time = ut.localize(deed.notify_time)
+        notification_time = rec.next_occurrence(notify_time, deed.recurrence, after=max(now, notify_time))
+        response = await self.backend.add_notification(deed.id, notification_time)
+        if response.status:
+            return None
+        if self.window_end and notification_time < self.window_end:
+            self.scheduler.schedule(deed.id, deed.telegram_id, notification_time)
+        logger.info(f"next occurrence of deed_id={deed.id} is {notification_time}")
+
+    async def process_deed_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE, deed_id: int):
         query = update.callback_query
-        await query.answer()
+        self.answer_query(query)
 
-        deed_id = int(query.data.split('=')[1])
-        response = self.backend.get_deed(deed_id)
+        response = await self.backend.get_deed(deed_id)
         deed = response.answer
         inline_markup = kb.get_inline_deed(deed)
 
         text = deed.name
         if deed.notify_time:
             text = text + f'\n🔔- {ut.repr_date(ut.localize(deed.notify_time), time_=True)}'
+        if deed.recurrence and rec.is_valid(deed.recurrence):
+            text = text + f' 🔁 {kb.recurrence_names[deed.recurrence]}'
 
         await query.message.reply_text(
             text,
@@ -254,34 +497,88 @@ class Client:
 
         return self.states.MAIN_MENU_CHOSE
 
-    async def process_done_deed_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    async def process_done_deed_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE, deed_id: int,
+                                         after_notify: bool = False):
         query = update.callback_query
-        await query.answer()
-
-        deed_id = int(query.data.split('=')[1])
-        response = self.backend.mark_deed_as_done(deed_id)
-        reset_job = self.reset_notification_job(str(deed_id), context)
+        self.answer_query(query)
+
+        if after_notify:
+            # done under a notification of a recurring deed closes only the occurrence, the series goes on
+            deed = (await self.backend.get_deed(deed_id)).answer
+            if deed.recurrence and not deed.done_flag:
+                notify_time = ut.repr_date(ut.localize(deed.notify_time), time_=True)
+                await query.message.reply_text(
+                    f"{pf.deed_done()}. {pf.next_notification()} {notify_time}",
+                    reply_markup=kb.get_start_keyboard()
+                )
+                return self.states.MAIN_MENU_CHOSE
+
+        reset_job = self.scheduler.cancel(deed_id)
         text = pf.deed_done()
         if reset_job:
             text += f". {pf.notification_canceled()}"
 
         markup = kb.get_start_keyboard()
-        await query.message.reply_text(
-            text,
-            reply_markup=markup
+        await asyncio.gather(
+            self.backend.mark_deed_as_done(deed_id),
+            query.message.reply_text(text, reply_markup=markup),
         )
 
         return self.states.MAIN_MENU_CHOSE
 
-    async def process_reschedule_deed_after_notify_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        query = update.callback_query
-        await query.answer()
+    async def done_all_deeds(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+        """/done_all can't be undone, the user confirms it first"""
+        user_id = update.message.from_user.id
+        response = await self.backend.get_deed_for_user(user_id)
+        if response.status:
+            return await self.start(update, context)
+        if not response.answer:
+            await update.message.reply_text(f"{pf.all_deeds_done()}: 0", reply_markup=kb.get_start_keyboard())
+            return self.states.MAIN_MENU_CHOSE
 
-        deed_id = int(query.data.split('=')[1])
+        await update.message.reply_text(
+            f"{pf.done_all_question()} ({len(response.answer)})?",
+            reply_markup=kb.bool_variants()
+        )
+        return self.states.PROCESS_DONE_ALL_CONFIRMATION
 
-        context.user_data['deed_id'] = deed_id
+    async def process_done_all_confirmation(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+        if update.message.text == menu_names.no_:
+            await update.message.reply_text("Oк!", reply_markup=kb.get_start_keyboard())
+            return self.states.MAIN_MENU_CHOSE
 
-        markup = kb.get_days()
+        # deeds are read again, the list could change while the question was open
+        user_id = update.message.from_user.id
+        response = await self.backend.get_deed_for_user(user_id)
+        if response.status:
+            return await self.start(update, context)
+        deed_ids = [deed.id for deed in response.answer]
+        for deed_id in deed_ids:
+            self.scheduler.cancel(deed_id)
+
+        markup = kb.get_start_keyboard()
+        reply = update.message.reply_text(f"{pf.all_deeds_done()}: {len(deed_ids)}", reply_markup=markup)
+        if deed_ids:
+            await asyncio.gather(self.backend.mark_deeds_as_done(deed_ids), reply)
+        else:
+            await reply
+
+        return self.states.MAIN_MENU_CHOSE
+
+    async def process_reschedule_deed_after_notify_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE,
+                                                            deed_id: int):
+        query = update.callback_query
+        self.answer_query(query)
+
+        context.user_data['deed_ids'] = [deed_id]
+        # rescheduling keeps the rule of a recurring deed unless it is switched off on the keyboard
+        response = await self.backend.get_deed(deed_id)
+        recurrence = None if response.status else response.answer.recurrence
+        if not rec.is_valid(recurrence):
+            recurrence = None
+        context.user_data['recurrence'] = recurrence
+
+        markup = kb.get_days(recurrence)
         text = f"{pf.chose_day()}:"
 
         await query.message.reply_text(
@@ -290,11 +587,11 @@ class Client:
         )
         return self.states.MAIN_MENU_CHOSE
 
-    async def process_rename_deed_name_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    async def process_rename_deed_name_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE,
+                                               deed_id: int):
         query = update.callback_query
-        await query.answer()
+        self.answer_query(query)
 
-        deed_id = int(query.data.split('=')[1])
         context.user_data['deed_id'] = deed_id
         text = f"{pf.text_new_deed_name()}:"
 
@@ -307,7 +604,7 @@ class Client:
     async def process_rename_deed(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         text = update.message.text
         deed_id = context.user_data['deed_id']
-        response = self.backend.rename_deed(deed_id, text)
+        response = await self.backend.rename_deed(deed_id, text)
 
         markup = kb.get_start_keyboard()
         text = pf.deed_renamed()
@@ -320,7 +617,7 @@ class Client:
 
     async def process_dzyn_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query
-        await query.answer()
+        self.answer_query(query)
 
         text = pf.dzyn()
 
@@ -331,66 +628,203 @@ class Client:
         return self.states.MAIN_MENU_CHOSE
 
     def initialize_notifications(self):
-        logger.info('move to all active deeds')
-        response = self.backend.get_active_deeds()
-        logger.info('passed to all active deeds')
-        # print(response)
-        deeds = response.answer
-
-        for deed in deeds:
-            # notification_time = ut.localize(deed.notify_time)
-            notification_time = deed.notify_time
-            if notification_time < ut.localize(datetime.now()):
-                # if notification_time < datetime.now():
-                continue
-            user_id = deed.telegram_id
-            deed_id = deed.id
-            self.application.job_queue.run_once(self.notification, when=notification_time, user_id=user_id,
-                                                data=str(deed_id), name=str(deed_id))
+        """startup loads only the first window, the rest is loaded by the periodic refill"""
+        if self.shards:
+            self.application.job_queue.run_repeating(timed_handler(self.rebalance_shards),
+                                                     interval=self.shards.lease_ttl / 3, first=0)
+        refill_interval = self.notification_window / 2
+        self.application.job_queue.run_repeating(timed_handler(self.refill_notifications),
+                                                 interval=refill_interval, first=0)
+
+    async def catch_up_recurring_deeds(self, now: datetime) -> None:
+        """recurring deeds whose occurrences were missed while bot was down are moved to their next occurrence"""
+        response = await self.backend.get_overdue_recurring_deeds(now)
+        if response.status or not response.answer:
+            return None
+        notifications = {deed.id: rec.next_occurrence(deed.notify_time, deed.recurrence, after=now)
+                         for deed in response.answer if rec.is_valid(deed.recurrence)}
+        if not notifications:
+            return None
+        await self.backend.advance_notifications(notifications)
+
+    async def load_notifications(self,
+                                 since: datetime,
+                                 until: datetime,
+                                 shards: Iterable[int] = None,
+                                 undelivered_only: bool = False) -> Optional[int]:
+        """schedule notifications of active deeds at [since, until), due ones fire at once;
+        returns number of scheduled notifications or None if they were not loaded"""
+        num_shards = 0
+        if shards is not None:
+            if not shards:
+                return 0
+            num_shards = self.shards.num_shards
+
+        response = await self.backend.get_active_deeds(since=since, until=until, num_shards=num_shards,
+                                                       shards=shards, undelivered_only=undelivered_only)
+        if response.status:
+            return None
+
+        now = ut.localize(datetime.now())
+        scheduled = 0
+        try:
+            async for deeds in response.answer:
+                for deed in deeds:
+                    deed_id = deed.id
+                    if deed_id in self.scheduler or deed_id in self._firing:
+                        continue
+                    self.scheduler.schedule(deed_id, deed.telegram_id, max(ut.localize(deed.notify_time), now))
+                    scheduled += 1
+        except Exception as e:
+            logger.error(f"notifications from {since} to {until} were not loaded, exception - {e}")
+            return None
+
+        logger.info(f'{scheduled} notifications from {since} to {until} were scheduled')
+        return scheduled
+
+    async def refill_notifications(self, context: ContextTypes.DEFAULT_TYPE) -> None:
+        if self.window_end is None:
+            await self.catch_up_recurring_deeds(ut.localize(datetime.now()))
+
+        now = ut.localize(datetime.now())
+        since = self.window_end or now
+        until = max(since, now + self.notification_window)
+        # move window before the query, make_job schedules new notifications inside it itself
+        self.window_end = until
+
+        shards = self.shards.owned if self.shards else None
+        if self.shards:
+            # due notifications nobody delivered, e.g. scheduled by an instance which died before firing
+            await self.load_notifications(now - self.notification_window, now, shards, undelivered_only=True)
+
+        logger.info(f'load notifications from {since} to {until}')
+        if await self.load_notifications(since, until, shards) is None:
+            self.window_end = since
+
+    async def rebalance_shards(self, context: ContextTypes.DEFAULT_TYPE) -> None:
+        gained, lost = await self.shards.rebalance()
+        if lost:
+            cancelled = self.scheduler.cancel_users(lambda user_id: self.shards.shard_of(user_id) in lost)
+            logger.info(f"{cancelled} notifications of lost shards were dropped")
+        if gained and self.window_end:
+            # previous owner could leave due notifications undelivered, they are sent late but once
+            since = ut.localize(datetime.now()) - self.notification_window
+            await self.load_notifications(since, self.window_end, gained, undelivered_only=True)
 
     async def done(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ConversationHandler.END
 
+    async def dump_metrics(self, context: ContextTypes.DEFAULT_TYPE) -> None:
+        logger.info(f"metrics:\n{registry.render()}")
+
+    async def post_init(self, application: Application) -> None:
+        self.dispatcher.start(application.bot)
+        self.scheduler.start()
+        if self.metrics_port:
+            self.metrics_server = await serve('0.0.0.0', self.metrics_port)
+
+    async def post_shutdown(self, application: Application) -> None:
+        await asyncio.gather(*self._answers)
+        await self.scheduler.stop()
+        if self.shards:
+            await self.shards.release()
+        await self.dispatcher.stop()
+        if self.metrics_server:
+            self.metrics_server.close()
+            await self.metrics_server.wait_closed()
+
+    def build_callback_routers(self) -> tuple[cb.CallbackRouter, cb.CallbackRouter]:
+        """buttons under notifications reenter the conversation from any state, the rest work in main menu"""
+        entry_routes = {
+            cb.NOTIFY_DONE: partial(self.process_done_deed_callback, after_notify=True),
+            cb.NOTIFY_TIMER: self.process_reschedule_deed_after_notify_callback,
+            cb.TIMER: self.process_reschedule_deed_after_notify_callback,
+        }
+        menu_routes = {
+            cb.DEED: self.process_deed_callback,
+            cb.DEEDS_BEFORE: partial(self.process_deeds_page_callback, before=True),
+            cb.DEEDS_AFTER: partial(self.process_deeds_page_callback, before=False),
+            cb.DONE: self.process_done_deed_callback,
+            cb.RENAME: self.process_rename_deed_name_callback,
+            cb.DAY: self.process_day_callback,
+            cb.REPEAT: self.process_repeat_callback,
+            cb.HOUR: self.process_hour_callback,
+            cb.MINUTE: self.process_minute_callback,
+            cb.POSTPONE: self.process_postpone_callback,
+            cb.DZYN: self.process_dzyn_callback,
+        }
+        return (cb.CallbackRouter({op: timed_handler(handler) for op, handler in entry_routes.items()}),
+                cb.CallbackRouter({op: timed_handler(handler) for op, handler in menu_routes.items()}))
+
     def build_conversation_handler(self):
+        entry_router, menu_router = self.build_callback_routers()
         conv_handler = ConversationHandler(
+            name='main',
+            persistent=self.application.persistence is not None,
             allow_reentry=True,
             entry_points=[
-                    CommandHandler("start", self.start),
-                    CallbackQueryHandler(self.process_done_deed_callback, pattern="^notify_done_deed_id="),
-                    CallbackQueryHandler(self.process_reschedule_deed_after_notify_callback,
-                                         pattern="^(notify_timer_deed_id=|timer_deed_id=)")
+                    CommandHandler("start", timed_handler(self.start)),
+                    CommandHandler("done_all", timed_handler(self.done_all_deeds)),
+                    CommandHandler("add_many", timed_handler(self.add_many_deeds)),
+                    entry_router.handler(),
             ],
             states={
                 self.states.MAIN_MENU_CHOSE: [
-                    MessageHandler(filters.Regex(ut.name_to_reg(menu_names.show_deeds)), self.show_deeds),
-                    MessageHandler(filters.Regex(ut.name_to_reg(menu_names.add_deed)), self.add_deed),
-                    CallbackQueryHandler(self.process_deed_callback, pattern="^deed_id="),
-                    CallbackQueryHandler(self.process_done_deed_callback, pattern="^done_deed_id="),
-                    CallbackQueryHandler(self.process_rename_deed_name_callback, pattern="^rename_deed_id="),
-                    CallbackQueryHandler(self.process_day_callback, pattern="^day="),
-                    CallbackQueryHandler(self.process_hour_callback, pattern="^hour="),
-                    CallbackQueryHandler(self.process_minute_callback, pattern="^minute="),
-                    CallbackQueryHandler(self.process_postpone_callback, pattern="^postpone="),
-                    CallbackQueryHandler(self.process_dzyn_callback, pattern=ut.name_to_reg('dzyn')),
+                    MessageHandler(filters.Regex(ut.name_to_reg(menu_names.show_deeds)),
+                                   timed_handler(self.show_deeds)),
+                    MessageHandler(filters.Regex(ut.name_to_reg(menu_names.add_deed)), timed_handler(self.add_deed)),
+                    MessageHandler(quick_add.QuickReminderFilter(), timed_handler(self.process_quick_reminder)),
+                    menu_router.handler(),
                 ],
                 self.states.PROCESS_DEED_NAME: [
-                    MessageHandler(filters.TEXT, self.process_deed_name)
+                    MessageHandler(filters.TEXT, timed_handler(self.process_deed_name))
+                ],
+                self.states.PROCESS_DEED_NAMES: [
+                    MessageHandler(filters.TEXT, timed_handler(self.process_deed_names))
                 ],
                 self.states.PROCESS_NOTIFICATION_FACT: [
-                    MessageHandler(filters.Regex(f"{menu_names.yes_}|{menu_names.no_}"), self.process_notification_fact),
+                    MessageHandler(filters.Regex(f"{menu_names.yes_}|{menu_names.no_}"),
+                                   timed_handler(self.process_notification_fact)),
+                ],
+                self.states.PROCESS_DONE_ALL_CONFIRMATION: [
+                    MessageHandler(filters.Regex(f"{menu_names.yes_}|{menu_names.no_}"),
+                                   timed_handler(self.process_done_all_confirmation)),
                 ],
                 self.states.PROCESS_RENAME_DEED_NAME: [
-                    MessageHandler(filters.TEXT, self.process_rename_deed)
+                    MessageHandler(filters.TEXT, timed_handler(self.process_rename_deed))
                 ],
             },
-            fallbacks=[MessageHandler(filters.Regex("^Done$"), self.done)],
+            fallbacks=[MessageHandler(filters.Regex("^Done$"), timed_handler(self.done))],
         )
 
         return conv_handler
 
-    def build_application(self):
+    def setup_application(self):
         logger.info('start to initialize app')
         self.initialize_notifications()
+        if self.metrics_dump_interval:
+            self.application.job_queue.run_repeating(self.dump_metrics, interval=self.metrics_dump_interval)
         conv_handler = self.build_conversation_handler()
         self.application.add_handler(conv_handler)
-        self.application.run_polling(drop_pending_updates=True)
+
+    def build_application(self,
+                          webhook_url: str = None,
+                          webhook_listen: str = '0.0.0.0',
+                          webhook_port: int = 8443,
+                          webhook_secret: str = None):
+        """long polling by default, with webhook_url telegram pushes updates to the embedded http server,
+        which listens on the path of webhook_url"""
+        self.setup_application()
+        if webhook_url:
+            logger.info(f'start webhook on {webhook_listen}:{webhook_port} for {webhook_url}')
+            self.application.run_webhook(
+                listen=webhook_listen,
+                port=webhook_port,
+                url_path=urlparse(webhook_url).path,
+                webhook_url=webhook_url,
+                secret_token=webhook_secret,
+                drop_pending_updates=True,
+            )
+        else:
+            self.application.run_polling(drop_pending_updates=True)
+        self.backend.shutdown()
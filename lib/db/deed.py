@@ -1,10 +1,15 @@
 import os
-from sqlalchemy import create_engine, schema, Column, Integer, String, DateTime, Boolean
+import time
+from sqlalchemy import (create_engine, schema, text, Column, Index, Integer, BigInteger, String, DateTime, Boolean,
+                        Sequence, LargeBinary)
 from sqlalchemy_utils import database_exists, create_database
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
 import logging
 
 from configs.definitions import ROOT_DIR
+from lib.metrics import registry
 import utils.utils as ut
 
 logger = logging.getLogger(__name__)
@@ -13,26 +18,123 @@ Base = declarative_base()
 
 DATABASE_NAME = 'notification_bot'
 SCHEMA_NAME = 'bot_data'
+DEED_ID_SEQUENCE_NAME = 'deed_id_seq'
 
 
 class Deed(Base):
 
     __tablename__ = 'deed'
-    id = Column(Integer, primary_key=True)
+    id = Column(Integer, Sequence(DEED_ID_SEQUENCE_NAME, schema=SCHEMA_NAME), primary_key=True)
     telegram_id = Column(Integer)
     name = Column(String)
     create_time = Column(DateTime)
     notify_time = Column(DateTime(timezone=True))
     done_flag = Column(Boolean)
+    # None for a single notification, else rule of lib.recurrence, notify_time holds the next occurrence only
+    recurrence = Column(String)
+    # notify_time of the last delivered notification, claimed by the instance which sends it
+    notified_at = Column(DateTime(timezone=True))
 
-    __table_args__ = {'schema': 'bot_data'}
+    __table_args__ = (
+        Index('ix_deed_telegram_id_done_flag_id', 'telegram_id', 'done_flag', 'id'),
+        Index(
+            'ix_deed_active_notify_time',
+            'notify_time',
+            postgresql_where=text('NOT done_flag'),
+            sqlite_where=text('NOT done_flag'),
+        ),
+        {'schema': SCHEMA_NAME},
+    )
 
 
-def get_engine(postgres_password: str, postgres_port:str, postgres_host:str):
+class ShardLease(Base):
+    """owner instance of notifications of telegram_ids with abs(telegram_id) % shards == shard"""
+
+    __tablename__ = 'shard_lease'
+    shard = Column(Integer, primary_key=True, autoincrement=False)
+    owner = Column(String)
+    expires_at = Column(DateTime)  # utc
+
+    __table_args__ = {'schema': SCHEMA_NAME}
+
+
+class BotInstance(Base):
+    """live bot instances, shards are split evenly between them"""
+
+    __tablename__ = 'bot_instance'
+    instance_id = Column(String, primary_key=True)
+    expires_at = Column(DateTime)  # utc
+
+    __table_args__ = {'schema': SCHEMA_NAME}
+
+
+class UserData(Base):
+    """pickled context.user_data of telegram user"""
+
+    __tablename__ = 'user_data'
+    user_id = Column(BigInteger, primary_key=True, autoincrement=False)
+    data = Column(LargeBinary)
+
+    __table_args__ = {'schema': SCHEMA_NAME}
+
+
+class ConversationState(Base):
+    """state of ConversationHandler `name` for conversation key, json list of chat and user ids"""
+
+    __tablename__ = 'conversation_state'
+    name = Column(String, primary_key=True)
+    key = Column(String, primary_key=True)
+    state = Column(Integer)
+
+    __table_args__ = {'schema': SCHEMA_NAME}
+
+
+pool_checkout_wait = registry.histogram('db_pool_checkout_wait_seconds', 'time spent waiting for a pooled connection')
+pool_checkout_timeouts = registry.counter('db_pool_checkout_timeouts_total', 'checkouts which hit pool_timeout')
+pool_connections = registry.gauge('db_pool_connections', 'connections of the pool by state')
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool which measures how long checkouts wait for a free connection"""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            pool_checkout_timeouts.inc()
+            raise
+        finally:
+            pool_checkout_wait.observe(time.perf_counter() - start)
+
+
+def get_engine(postgres_password: str,
+               postgres_port: str,
+               postgres_host: str,
+               pool_size: int = 5,
+               max_overflow: int = 10,
+               pool_recycle: int = 1800,
+               pool_pre_ping: bool = True,
+               pool_timeout: float = 30):
     url = f'postgresql+psycopg2://postgres:{postgres_password}@{postgres_host}:{postgres_port}/{DATABASE_NAME}'
-    postgres_engine = create_engine(url)
+    postgres_engine = create_engine(
+        url,
+        poolclass=InstrumentedQueuePool,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_recycle=pool_recycle,
+        pool_pre_ping=pool_pre_ping,
+        pool_timeout=pool_timeout,
+    )
+
+    pool = postgres_engine.pool
+    pool_connections.set_function(pool.checkedout, state='in_use')
+    pool_connections.set_function(pool.checkedin, state='idle')
+    pool_connections.set_function(pool.overflow, state='overflow')
+
     logger.info('engine was passed')
-    logger.info(f"{url}")
+    logger.info(f"{postgres_engine.url}, {pool_size=}, {max_overflow=}, {pool_recycle=}, {pool_pre_ping=}, "
+                f"{pool_timeout=}")
     return postgres_engine
 
 
@@ -48,7 +150,8 @@ def create_data_base_and_tables(engine):
         if not engine.dialect.has_schema(engine, SCHEMA_NAME):
             engine.execute(schema.CreateSchema(SCHEMA_NAME))
 
-        Base.metadata.create_all(engine)
+        from lib.db.migrations import apply_migrations
+        apply_migrations(engine)
 
         logger.info('end to create data base meta')
 
@@ -56,8 +159,6 @@ def create_data_base_and_tables(engine):
         logger.error(f"Couldn't create meta data; exception - \n{e}")
         return None
 
-    
-
 
 if __name__ == '__main__':
 
@@ -0,0 +1,168 @@
+"""Versioned schema migrations of the bot database.
+
+Applied versions are stored in bot_data.schema_version. To change the schema append a Migration
+with the next version to MIGRATIONS, never edit the ones which were already released.
+"""
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable
+from sqlalchemy import (MetaData, Table, Column, Integer, String, DateTime, Boolean, text, select, insert, func,
+                        inspect)
+import logging
+
+from lib.db.deed import (Deed, ShardLease, BotInstance, UserData, ConversationState, SCHEMA_NAME,
+                         DEED_ID_SEQUENCE_NAME)
+
+logger = logging.getLogger(__name__)
+
+# any constant shared by all instances, serializes concurrent startups
+MIGRATION_LOCK_ID = 1349
+
+metadata = MetaData()
+
+schema_version = Table(
+    'schema_version',
+    metadata,
+    Column('version', Integer, primary_key=True),
+    Column('description', String),
+    Column('applied_at', DateTime),
+    schema=SCHEMA_NAME,
+)
+
+
+@dataclass
+class Migration:
+    version: int
+    description: str
+    apply: Callable  # receives sqlalchemy connection inside the migration transaction
+
+
+def _schema_name(connection) -> str:
+    """bot schema respecting schema_translate_map of sqlite stand-ins, None there"""
+    return connection.get_execution_options().get('schema_translate_map', {}).get(SCHEMA_NAME, SCHEMA_NAME)
+
+
+def _qualified(connection, name: str) -> str:
+    """name in bot schema"""
+    schema_name = _schema_name(connection)
+    return f"{schema_name}.{name}" if schema_name else name
+
+
+def create_deed_table(connection) -> None:
+    """deed table as it was released first, later columns and indexes are added by their migrations"""
+    deed = Table(
+        Deed.__tablename__,
+        MetaData(),
+        Column('id', Integer, primary_key=True),
+        Column('telegram_id', Integer),
+        Column('name', String),
+        Column('create_time', DateTime),
+        Column('notify_time', DateTime(timezone=True)),
+        Column('done_flag', Boolean),
+        schema=SCHEMA_NAME,
+    )
+    deed.create(connection, checkfirst=True)
+
+
+def attach_deed_id_sequence(connection) -> None:
+    """deed ids used to be allocated as MAX(id)+1, attach the sequence and move it past existing ids"""
+    if connection.dialect.name != 'postgresql':
+        return None
+
+    sequence = f"{SCHEMA_NAME}.{DEED_ID_SEQUENCE_NAME}"
+    table = f"{SCHEMA_NAME}.{Deed.__tablename__}"
+
+    connection.execute(text(f"CREATE SEQUENCE IF NOT EXISTS {sequence}"))
+    connection.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY {table}.id"))
+    connection.execute(text(f"ALTER TABLE {table} ALTER COLUMN id SET DEFAULT nextval('{sequence}')"))
+    connection.execute(text(
+        f"SELECT setval('{sequence}', GREATEST(COALESCE(MAX(id), 0), (SELECT last_value FROM {sequence}))) "
+        f"FROM {table}"
+    ))
+
+
+def create_deed_indexes(connection) -> None:
+    table = _qualified(connection, Deed.__tablename__)
+    connection.execute(text(f"CREATE INDEX IF NOT EXISTS ix_deed_telegram_id_done_flag ON {table} "
+                            f"(telegram_id, done_flag)"))
+    connection.execute(text(f"CREATE INDEX IF NOT EXISTS ix_deed_active_notify_time ON {table} "
+                            f"(notify_time) WHERE NOT done_flag"))
+
+
+def extend_user_index_with_id(connection) -> None:
+    """deed list is paginated by id, index has to cover the order"""
+    table = _qualified(connection, Deed.__tablename__)
+    connection.execute(text(f"CREATE INDEX IF NOT EXISTS ix_deed_telegram_id_done_flag_id ON {table} "
+                            f"(telegram_id, done_flag, id)"))
+    connection.execute(text(f"DROP INDEX IF EXISTS {_qualified(connection, 'ix_deed_telegram_id_done_flag')}"))
+
+
+def _add_deed_column(connection, name: str, column_type: str) -> None:
+    columns = inspect(connection).get_columns(Deed.__tablename__, schema=_schema_name(connection))
+    if name in {column['name'] for column in columns}:
+        return None
+    connection.execute(text(f"ALTER TABLE {_qualified(connection, Deed.__tablename__)} ADD COLUMN {name} {column_type}"))
+
+
+def add_deed_recurrence(connection) -> None:
+    """nullable column, existing deeds stay single notifications"""
+    _add_deed_column(connection, 'recurrence', 'VARCHAR')
+
+
+def add_notification_claims(connection) -> None:
+    """notifications due before the upgrade count as delivered, otherwise the sweep of undelivered ones
+    would resend them"""
+    _add_deed_column(connection, 'notified_at', 'TIMESTAMP WITH TIME ZONE')
+    table = _qualified(connection, Deed.__tablename__)
+    connection.execute(text(f"UPDATE {table} SET notified_at = notify_time WHERE notify_time < :now"),
+                       {'now': datetime.now().astimezone()})
+    ShardLease.__table__.create(connection, checkfirst=True)
+    BotInstance.__table__.create(connection, checkfirst=True)
+
+
+def create_persistence_tables(connection) -> None:
+    UserData.__table__.create(connection, checkfirst=True)
+    ConversationState.__table__.create(connection, checkfirst=True)
+
+
+MIGRATIONS = [
+    Migration(1, 'create deed table', create_deed_table),
+    Migration(2, 'allocate deed ids from sequence', attach_deed_id_sequence),
+    Migration(3, 'index deeds by user and by active notify time', create_deed_indexes),
+    Migration(4, 'index deeds by user in id order', extend_user_index_with_id),
+    Migration(5, 'add recurrence rule of deed', add_deed_recurrence),
+    Migration(6, 'claim delivered notifications and lease notification shards', add_notification_claims),
+    Migration(7, 'persist user data and conversation states', create_persistence_tables),
+]
+
+
+def get_schema_version(connection) -> int:
+    version = connection.execute(select(func.max(schema_version.c.version))).scalar()
+    return version or 0
+
+
+def apply_migrations(engine, migrations: list[Migration] = None) -> int:
+    """apply pending migrations in one transaction and return the resulting schema version"""
+    migrations = sorted(migrations or MIGRATIONS, key=lambda migration: migration.version)
+
+    with engine.begin() as connection:
+        if connection.dialect.name == 'postgresql':
+            connection.execute(text("SELECT pg_advisory_xact_lock(:lock_id)"), {'lock_id': MIGRATION_LOCK_ID})
+
+        schema_version.create(connection, checkfirst=True)
+        current_version = get_schema_version(connection)
+
+        for migration in migrations:
+            if migration.version <= current_version:
+                continue
+            migration.apply(connection)
+            connection.execute(insert(schema_version).values(
+                version=migration.version,
+                description=migration.description,
+                applied_at=datetime.now(),
+            ))
+            current_version = migration.version
+            logger.info(f"migration {migration.version} '{migration.description}' was applied")
+
+    logger.info(f"schema version is {current_version}")
+    return current_version
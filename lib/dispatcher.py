@@ -0,0 +1,174 @@
+"""Rate limited sending of notifications.
+
+Reminders cluster on the same minutes, so jobs don't call send_message themselves: they enqueue messages
+and a few sender tasks drain the queue under a global token bucket and a per-chat interval, which keeps
+the bot under Telegram flood limits. On RetryAfter all senders pause for the requested time.
+"""
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional
+from telegram import Bot
+from telegram.error import Forbidden, BadRequest, RetryAfter, TelegramError
+import asyncio
+import logging
+import time
+
+from lib.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+queue_depth = registry.gauge('notification_queue_depth', 'notifications waiting to be sent')
+send_lag = registry.histogram('notification_send_lag_seconds', 'time from enqueue to sent message')
+sent_messages = registry.counter('notification_sent_total', 'notification send attempts by result')
+
+
+@dataclass
+class OutgoingMessage:
+    chat_id: int
+    text: str
+    reply_markup: Any = None
+    on_sent: Optional[Callable[['OutgoingMessage'], None]] = None
+    enqueued_at: float = field(default_factory=time.monotonic)
+    attempts: int = 0
+
+
+class TokenBucket:
+    """allows `rate` acquisitions per second with bursts up to `capacity`"""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float) -> None:
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        # bucket starts refilling only after the pause
+        self.tokens = 0
+        self.updated = self.paused_until
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return None
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class NotificationDispatcher:
+
+    def __init__(self,
+                 rate: float = 30,
+                 per_chat_interval: float = 1.0,
+                 workers: int = 4,
+                 max_attempts: int = 3):
+        self.bucket = TokenBucket(rate)
+        self.per_chat_interval = per_chat_interval
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.queue: asyncio.Queue = None
+        self.bot: Bot = None
+        # chat_id -> monotonic time when the next message to the chat is allowed
+        self._chat_next_time: dict[int, float] = {}
+        self._tasks: list[asyncio.Task] = []
+        self._delayed: set[asyncio.TimerHandle] = set()
+
+    def start(self, bot: Bot) -> None:
+        self.bot = bot
+        self.queue = asyncio.Queue()
+        queue_depth.set_function(self.queue.qsize)
+        self._tasks = [asyncio.create_task(self._sender()) for _ in range(self.workers)]
+        logger.info(f"notification dispatcher was started, {self.workers} senders, {self.bucket.rate} msg/s")
+
+    async def stop(self, timeout: float = 10) -> None:
+        """wait until queued messages are sent, then cancel the senders"""
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"notification dispatcher was stopped with {self.queue.qsize()} unsent messages")
+        if self._delayed:
+            logger.error(f"notification dispatcher was stopped with {len(self._delayed)} delayed messages")
+        for handle in self._delayed:
+            handle.cancel()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def enqueue(self, chat_id: int, text: str, reply_markup: Any = None,
+                on_sent: Callable[[OutgoingMessage], None] = None) -> None:
+        self.queue.put_nowait(OutgoingMessage(chat_id, text, reply_markup, on_sent))
+
+    def _requeue_later(self, message: OutgoingMessage, delay: float) -> None:
+        loop = asyncio.get_running_loop()
+
+        def put():
+            self._delayed.discard(handle)
+            self.queue.put_nowait(message)
+
+        handle = loop.call_later(delay, put)
+        self._delayed.add(handle)
+
+    def _reserve_chat(self, chat_id: int) -> float:
+        """returns 0 and reserves the slot if chat can get message now, else seconds to wait"""
+        now = time.monotonic()
+        next_time = self._chat_next_time.get(chat_id, 0)
+        if next_time > now:
+            return next_time - now
+
+        self._chat_next_time[chat_id] = now + self.per_chat_interval
+        if len(self._chat_next_time) > 10000:
+            self._chat_next_time = {chat: until for chat, until in self._chat_next_time.items() if until > now}
+        return 0
+
+    async def _sender(self) -> None:
+        while True:
+            message = await self.queue.get()
+            try:
+                wait = self._reserve_chat(message.chat_id)
+                if wait:
+                    self._requeue_later(message, wait)
+                    continue
+                await self.bucket.acquire()
+                await self._send(message)
+            except Exception as e:
+                logger.error(f"notification to {message.chat_id} was not sent, exception - {e}")
+            finally:
+                self.queue.task_done()
+
+    async def _send(self, message: OutgoingMessage) -> None:
+        message.attempts += 1
+        try:
+            await self.bot.send_message(message.chat_id, text=message.text, reply_markup=message.reply_markup)
+        except RetryAfter as e:
+            sent_messages.inc(result='retry_after')
+            logger.error(f"flood limit, senders pause for {e.retry_after}s")
+            self.bucket.pause(e.retry_after)
+            self._requeue_later(message, e.retry_after)
+            return None
+        except (Forbidden, BadRequest) as e:
+            # user blocked the bot or chat is gone, retry won't help
+            sent_messages.inc(result='rejected')
+            logger.error(f"notification to {message.chat_id} was rejected, exception - {e}")
+            return None
+        except TelegramError as e:
+            if message.attempts < self.max_attempts:
+                sent_messages.inc(result='retry')
+                self._requeue_later(message, message.attempts)
+            else:
+                sent_messages.inc(result='failed')
+                logger.error(f"notification to {message.chat_id} failed {message.attempts} times, exception - {e}")
+            return None
+
+        sent_messages.inc(result='sent')
+        send_lag.observe(time.monotonic() - message.enqueued_at)
+        if message.on_sent:
+            message.on_sent(message)
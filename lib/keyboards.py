@@ -1,6 +1,9 @@
 from telegram import ReplyKeyboardMarkup, InlineKeyboardMarkup, InlineKeyboardButton
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+from functools import lru_cache
 import utils.utils as ut
+import lib.recurrence as rec
+import lib.callbacks as cb
 
 menu_names = ut.get_menu_names()
 
@@ -9,30 +12,46 @@ start_keyboard_options = [
         [menu_names.add_deed]
     ]
 
+recurrence_names = {
+    rec.DAILY: '1day',
+    rec.WEEKDAYS: 'workdays',
+    rec.WEEKLY: '1week',
+}
+
 
 def process_deeds(deed: 'Deed') -> str:
-    # notify_emoji = '🔔 ' if deed.notify_time and ut.localize(deed.notify_time) > ut.localize(datetime.now()) else ''
-    notify_emoji = '🔔 ' if deed.notify_time and deed.notify_time > ut.localize(datetime.now()) else ''
+    notify_emoji = '🔔 ' if deed.notify_time and ut.localize(deed.notify_time) > ut.localize(datetime.now()) else ''
+    if deed.recurrence:
+        notify_emoji = '🔁 '
     return notify_emoji + deed.name
 
 
-def get_start_keyboard() -> ReplyKeyboardMarkup:
+def build_start_keyboard() -> ReplyKeyboardMarkup:
     markup = ReplyKeyboardMarkup(start_keyboard_options, one_time_keyboard=False, resize_keyboard=True)
     return markup
 
 
-def get_inline_deeds(deeds: list['Deeds']) -> InlineKeyboardMarkup:
+def get_inline_deeds(deeds: list['Deeds'], prev_before_id: int = None, next_after_id: int = None
+                     ) -> InlineKeyboardMarkup:
     keyboard = []
     for deed in deeds:
         text = process_deeds(deed)
-        deed_button = InlineKeyboardButton(text, callback_data=f"deed_id={deed.id}", )
+        deed_button = InlineKeyboardButton(text, callback_data=cb.encode(cb.DEED, deed.id))
         keyboard.append([deed_button])
 
+    page_row = []
+    if prev_before_id is not None:
+        page_row.append(InlineKeyboardButton('◀️', callback_data=cb.encode(cb.DEEDS_BEFORE, prev_before_id)))
+    if next_after_id is not None:
+        page_row.append(InlineKeyboardButton('▶️', callback_data=cb.encode(cb.DEEDS_AFTER, next_after_id)))
+    if page_row:
+        keyboard.append(page_row)
+
     reply_markup = InlineKeyboardMarkup(keyboard)
     return reply_markup
 
 
-def bool_variants() -> ReplyKeyboardMarkup:
+def build_bool_variants() -> ReplyKeyboardMarkup:
     text = [[menu_names.yes_, menu_names.no_]]
     markup = ReplyKeyboardMarkup(text, one_time_keyboard=True, resize_keyboard=True)
     return markup
@@ -40,9 +59,9 @@ def bool_variants() -> ReplyKeyboardMarkup:
 
 def get_inline_deed(deed: 'Deed') -> InlineKeyboardMarkup:
 
-    button_timer = InlineKeyboardButton('🔔', callback_data=f"timer_deed_id={deed.id}")
-    button_rename = InlineKeyboardButton('🖊️', callback_data=f"rename_deed_id={deed.id}")
-    button_done = InlineKeyboardButton('✅', callback_data=f"done_deed_id={deed.id}")
+    button_timer = InlineKeyboardButton('🔔', callback_data=cb.encode(cb.TIMER, deed.id))
+    button_rename = InlineKeyboardButton('🖊️', callback_data=cb.encode(cb.RENAME, deed.id))
+    button_done = InlineKeyboardButton('✅', callback_data=cb.encode(cb.DONE, deed.id))
 
     reply_markup = InlineKeyboardMarkup([[button_timer, button_rename, button_done]])
     return reply_markup
@@ -50,36 +69,46 @@ def get_inline_deed(deed: 'Deed') -> InlineKeyboardMarkup:
 
 def get_inline_deed_after_notify(deed: 'Deed') -> InlineKeyboardMarkup:
 
-    button_timer = InlineKeyboardButton('🔔', callback_data=f"notify_timer_deed_id={deed.id}")
-    button_done = InlineKeyboardButton('✅', callback_data=f"notify_done_deed_id={deed.id}")
+    button_timer = InlineKeyboardButton('🔔', callback_data=cb.encode(cb.NOTIFY_TIMER, deed.id))
+    button_done = InlineKeyboardButton('✅', callback_data=cb.encode(cb.NOTIFY_DONE, deed.id))
 
     reply_markup = InlineKeyboardMarkup([[button_timer, button_done]])
     return reply_markup
 
 
-def get_postpone_minutes() -> list[list[InlineKeyboardButton]]:
+def build_postpone_minutes() -> list[list[InlineKeyboardButton]]:
     keyboard = [
         [
-            InlineKeyboardButton('5min', callback_data='postpone=5'),
-            InlineKeyboardButton('10min', callback_data='postpone=10'),
-            InlineKeyboardButton('30min', callback_data='postpone=30'),
-            InlineKeyboardButton('1hour', callback_data='postpone=60'),
-            InlineKeyboardButton('1day', callback_data='postpone=1440'),
+            InlineKeyboardButton('5min', callback_data=cb.encode(cb.POSTPONE, 5)),
+            InlineKeyboardButton('10min', callback_data=cb.encode(cb.POSTPONE, 10)),
+            InlineKeyboardButton('30min', callback_data=cb.encode(cb.POSTPONE, 30)),
+            InlineKeyboardButton('1hour', callback_data=cb.encode(cb.POSTPONE, 60)),
+            InlineKeyboardButton('1day', callback_data=cb.encode(cb.POSTPONE, 1440)),
         ]
     ]
 
     return keyboard
 
 
-def get_days() -> InlineKeyboardMarkup:
+def get_recurrences(recurrence: str = None) -> list[list[InlineKeyboardButton]]:
+    """chosen rule is marked, pressing it again turns repetition off"""
+    row = []
+    for rule, name in recurrence_names.items():
+        if rule == recurrence:
+            row.append(InlineKeyboardButton(f'✅ 🔁 {name}', callback_data=cb.encode_repeat(None)))
+        else:
+            row.append(InlineKeyboardButton(f'🔁 {name}', callback_data=cb.encode_repeat(rule)))
+
+    return [row]
+
+
+def build_days(today: date, recurrence: str = None) -> InlineKeyboardMarkup:
 
-    keyboard = get_postpone_minutes()
-    # current_time = ut.localize(datetime.now())
-    current_time = datetime.now()
-    days = [current_time + timedelta(days=day_add) for day_add in range(9)]
+    keyboard = get_postpone_minutes() + get_recurrences(recurrence)
+    days = [today + timedelta(days=day_add) for day_add in range(9)]
     showed_days = [ut.repr_date(day) for day in days]
     for ix, day in enumerate(showed_days):
-        button = InlineKeyboardButton(day, callback_data=f'day={ix}')
+        button = InlineKeyboardButton(day, callback_data=cb.encode(cb.DAY, ix))
         if not ix % 3:
             curr_row = [button]
         elif ix % 3 == 1:
@@ -92,12 +121,12 @@ def get_days() -> InlineKeyboardMarkup:
     return reply_markup
 
 
-def get_hours() -> InlineKeyboardMarkup:
+def build_hours() -> InlineKeyboardMarkup:
     keyboard = []
     curr_row = []
     for hour in range(24):
         str_hour = '0' + str(hour) if hour < 10 else str(hour)
-        button = InlineKeyboardButton(str_hour, callback_data=f"hour={hour}")
+        button = InlineKeyboardButton(str_hour, callback_data=cb.encode(cb.HOUR, hour))
         curr_row.append(button)
         if hour % 4 == 3:
             keyboard.append(curr_row)
@@ -107,12 +136,12 @@ def get_hours() -> InlineKeyboardMarkup:
     return reply_markup
 
 
-def get_minutes() -> InlineKeyboardMarkup:
+def build_minutes() -> InlineKeyboardMarkup:
     keyboard = []
     curr_row = []
     for minute in range(0, 60, 5):
         str_minute = '0' + str(minute) if minute < 10 else str(minute)
-        button = InlineKeyboardButton(str_minute, callback_data=f"minute={minute}")
+        button = InlineKeyboardButton(str_minute, callback_data=cb.encode(cb.MINUTE, minute))
         curr_row.append(button)
         if minute % 20 == 15:
             keyboard.append(curr_row)
@@ -122,6 +151,49 @@ def get_minutes() -> InlineKeyboardMarkup:
     return reply_markup
 
 
-def dzyn_keyboard() -> InlineKeyboardMarkup:
-    reply_markup = InlineKeyboardMarkup([[InlineKeyboardButton("🥂", callback_data='dzyn')]])
+def build_dzyn_keyboard() -> InlineKeyboardMarkup:
+    reply_markup = InlineKeyboardMarkup([[InlineKeyboardButton("🥂", callback_data=cb.encode(cb.DZYN))]])
     return reply_markup
+
+
+# markups which are the same for everybody are built once and shared, they must not be mutated
+start_keyboard = build_start_keyboard()
+bool_keyboard = build_bool_variants()
+postpone_minutes = build_postpone_minutes()
+hours_keyboard = build_hours()
+minutes_keyboard = build_minutes()
+dzyn_markup = build_dzyn_keyboard()
+
+
+def get_start_keyboard() -> ReplyKeyboardMarkup:
+    return start_keyboard
+
+
+def bool_variants() -> ReplyKeyboardMarkup:
+    return bool_keyboard
+
+
+def get_postpone_minutes() -> list[list[InlineKeyboardButton]]:
+    return list(postpone_minutes)
+
+
+def get_hours() -> InlineKeyboardMarkup:
+    return hours_keyboard
+
+
+def get_minutes() -> InlineKeyboardMarkup:
+    return minutes_keyboard
+
+
+def dzyn_keyboard() -> InlineKeyboardMarkup:
+    return dzyn_markup
+
+
+@lru_cache(maxsize=16)
+def _get_days_of(today: date, recurrence: str) -> InlineKeyboardMarkup:
+    return build_days(today, recurrence)
+
+
+def get_days(recurrence: str = None) -> InlineKeyboardMarkup:
+    """memoized per local calendar day, the key changes at midnight so the keyboard rolls over by itself"""
+    return _get_days_of(date.today(), recurrence)
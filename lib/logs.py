@@ -0,0 +1,122 @@
+"""Logging of the bot.
+
+Records are only put into a queue by the calling thread, a background thread formats them as json lines
+and writes them to size rotated files, so handlers on the event loop never wait for the disk. Records up
+to INFO go to stdout_notify_bot_log.txt, the rest to stderr_notify_bot_log.txt. Levels are set per logger,
+e.g. {'': 'WARNING', 'lib': 'INFO', 'lib.backend': 'DEBUG'}.
+"""
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Optional
+import atexit
+import json
+import logging
+import os
+import queue
+
+DEFAULT_LEVELS = {
+    '': 'WARNING',
+    'lib': 'INFO',
+}
+
+_listener: Optional[QueueListener] = None
+
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class _EnqueueHandler(QueueHandler):
+    """keeps the record as it is, message and exception are formatted by the writer thread"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # the handler is the only one and sits on the root logger, no handler sees the record after it,
+        # so it is changed in place instead of copied
+        if record.exc_info:
+            # traceback objects must not outlive the call, it is rendered here
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def parse_levels(text: str) -> dict[str, str]:
+    """"lib=INFO,lib.backend=DEBUG" -> {'lib': 'INFO', 'lib.backend': 'DEBUG'}, root logger is named root"""
+    levels = {}
+    for item in text.split(','):
+        if not item.strip():
+            continue
+        name, _, level = item.partition('=')
+        name = name.strip()
+        levels['' if name == 'root' else name] = level.strip().upper()
+    return levels
+
+
+def _file_handler(path: str, max_bytes: int, backup_count: int, low: bool) -> RotatingFileHandler:
+    handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8',
+                                  delay=True)
+    if low:
+        handler.addFilter(lambda record: record.levelno <= logging.INFO)
+    else:
+        handler.addFilter(lambda record: record.levelno > logging.INFO)
+    handler.setFormatter(JsonFormatter())
+    return handler
+
+
+def setup_logging(directory: str = '.',
+                  levels: dict[str, str] = None,
+                  max_bytes: int = 10 * 1024 * 1024,
+                  backup_count: int = 5) -> None:
+    """can be called again to reconfigure, the previous writer thread is flushed and stopped"""
+    global _listener
+    stop_logging()
+
+    handlers = [
+        _file_handler(os.path.join(directory, 'stdout_notify_bot_log.txt'), max_bytes, backup_count, low=True),
+        _file_handler(os.path.join(directory, 'stderr_notify_bot_log.txt'), max_bytes, backup_count, low=False),
+    ]
+    records = queue.SimpleQueue()
+    _listener = QueueListener(records, *handlers, respect_handler_level=True)
+
+    # records don't carry caller, process and multiprocessing fields the files don't show,
+    # collecting them is the largest part of a logging call (see Optimization in logging docs)
+    logging._srcfile = None
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+
+    root_logger = logging.root
+    for handler in root_logger.handlers:
+        handler.close()
+    root_logger.handlers.clear()
+    root_logger.addHandler(_EnqueueHandler(records))
+    for name, level in {**DEFAULT_LEVELS, **(levels or {})}.items():
+        logging.getLogger(name).setLevel(level)
+
+    _listener.start()
+
+
+def stop_logging() -> None:
+    """writes out queued records, called at exit"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+atexit.register(stop_logging)
@@ -0,0 +1,235 @@
+"""In-process metrics rendered in prometheus text format.
+
+Metrics are cheap enough for the hot path: one lock and a couple of integer operations per observation.
+They are dumped to the log periodically and served over http by serve().
+"""
+from bisect import bisect_left
+from functools import wraps
+from typing import Callable
+import asyncio
+import threading
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(labels: tuple[tuple[str, str], ...], extra: tuple[tuple[str, str], ...] = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in pairs) + '}'
+
+
+def _labels_key(labels: dict) -> tuple[tuple[str, str], ...]:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+class Counter:
+
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = _labels_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_labels_key(labels), 0)
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_format_labels(key)} {value}" for key, value in values]
+
+
+class Gauge:
+    """gauge is either set explicitly or read from a function at render time"""
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._values: dict[tuple, float] = {}
+        self._functions: dict[tuple, Callable[[], float]] = {}
+        self._lock = threading.Lock()
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[_labels_key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = _labels_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: Callable[[], float], **labels) -> None:
+        with self._lock:
+            self._functions[_labels_key(labels)] = function
+
+    def value(self, **labels) -> float:
+        key = _labels_key(labels)
+        if key in self._functions:
+            return self._functions[key]()
+        return self._values.get(key, 0)
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            values = list(self._values.items())
+            functions = list(self._functions.items())
+        values += [(key, function()) for key, function in functions]
+        return [f"{self.name}{_format_labels(key)} {value}" for key, value in values]
+
+
+class Histogram:
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [bucket counts + inf bucket, sum]
+        self._values: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = _labels_key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def count(self, **labels) -> int:
+        state = self._values.get(_labels_key(labels))
+        return sum(state[0]) if state else 0
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            values = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+
+        lines = []
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(key, (('le', le),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {cumulative}")
+        return lines
+
+
+class Registry:
+
+    def __init__(self):
+        self._metrics: dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, metric_class, name: str, documentation: str, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = metric_class(name, documentation, **kwargs)
+            return metric
+
+    def counter(self, name: str, documentation: str) -> Counter:
+        return self._get_or_create(Counter, name, documentation)
+
+    def gauge(self, name: str, documentation: str) -> Gauge:
+        return self._get_or_create(Gauge, name, documentation)
+
+    def histogram(self, name: str, documentation: str, buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, documentation, buckets=buckets)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def timed(histogram: Histogram, errors: Counter = None, **labels) -> Callable:
+    """decorator which observes duration of a function or coroutine function, raised exceptions are counted"""
+    def decorator(func: Callable) -> Callable:
+        if asyncio.iscoroutinefunction(func):
+            @wraps(func)
+            async def inner(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                except Exception:
+                    if errors is not None:
+                        errors.inc(**labels)
+                    raise
+                finally:
+                    histogram.observe(time.perf_counter() - start, **labels)
+            return inner
+
+        @wraps(func)
+        def inner(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                if errors is not None:
+                    errors.inc(**labels)
+                raise
+            finally:
+                histogram.observe(time.perf_counter() - start, **labels)
+        return inner
+    return decorator
+
+
+async def _handle_scrape(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, metrics: Registry) -> None:
+    try:
+        request_line = await reader.readline()
+        # headers are not needed, they are read only to not reset the connection
+        while (await reader.readline()).strip():
+            pass
+        method, path, *_ = request_line.decode('latin-1').split() or ['', '']
+        if method == 'GET' and path.split('?')[0] in ('/', '/metrics'):
+            status, body = '200 OK', metrics.render().encode()
+        else:
+            status, body = '404 Not Found', b'not found\n'
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except Exception as e:
+        logger.error(f"metrics scrape failed, exception - {e}")
+    finally:
+        writer.close()
+
+
+async def serve(host: str, port: int, metrics: Registry = registry) -> asyncio.AbstractServer:
+    """plain http endpoint for prometheus, the text is rendered on the event loop on every scrape"""
+    server = await asyncio.start_server(lambda reader, writer: _handle_scrape(reader, writer, metrics), host, port)
+    logger.info(f"metrics are served on {host}:{port}/metrics")
+    return server
@@ -0,0 +1,170 @@
+"""Durable user_data and conversation states in the bot database.
+
+Application hands changed user_data and conversation states over every update_interval seconds. They are
+only buffered here, coalesced by user and conversation, and written right after the hand-over in one
+transaction in the backend thread pool, so handlers don't wait for the database. On shutdown pending
+changes are flushed, a crash loses at most the last update_interval.
+"""
+from collections import defaultdict
+from concurrent.futures import Executor
+from typing import Optional
+from sqlalchemy import delete, insert, select
+from telegram.ext import BasePersistence, PersistenceInput
+import asyncio
+import json
+import logging
+import pickle
+import time
+
+from lib.backend import TableProcessor, db_executor, db_selector, run_in_executor
+from lib.db.deed import UserData, ConversationState
+from lib.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+flush_time = registry.histogram('persistence_flush_seconds', 'time of writing buffered persistence changes')
+flushed_rows = registry.counter('persistence_flushed_rows_total', 'rows written by persistence flushes by kind')
+
+
+class PersistenceProcessor(TableProcessor):
+
+    @db_selector
+    def load_user_data(self, session=None) -> dict[int, bytes]:
+        rows = session.execute(select(UserData.user_id, UserData.data))
+        return {user_id: data for user_id, data in rows}
+
+    @db_selector
+    def load_conversations(self, name: str, session=None) -> dict[str, int]:
+        rows = session.execute(select(ConversationState.key, ConversationState.state)
+                               .where(ConversationState.name == name))
+        return {key: state for key, state in rows}
+
+    @db_executor
+    def write(self, user_data: dict[int, Optional[bytes]], conversations: dict[tuple[str, str], Optional[int]],
+              session=None) -> None:
+        """replace rows of passed keys, None value deletes the row"""
+        if user_data:
+            users = UserData.__table__
+            session.execute(delete(users).where(users.c.user_id.in_(list(user_data))))
+            rows = [{'user_id': user_id, 'data': data} for user_id, data in user_data.items() if data is not None]
+            if rows:
+                session.execute(insert(users), rows)
+
+        if conversations:
+            states = ConversationState.__table__
+            keys_by_name = defaultdict(list)
+            for name, key in conversations:
+                keys_by_name[name].append(key)
+            for name, keys in keys_by_name.items():
+                session.execute(delete(states).where(states.c.name == name).where(states.c.key.in_(keys)))
+            rows = [{'name': name, 'key': key, 'state': state}
+                    for (name, key), state in conversations.items() if state is not None]
+            if rows:
+                session.execute(insert(states), rows)
+
+
+class DbPersistence(BasePersistence):
+    """user_data and conversation states, chat_data, bot_data and callback data are not used by the bot"""
+
+    def __init__(self, engine, executor: Executor, update_interval: float = 5):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.processor = PersistenceProcessor(engine)
+        self.executor = executor
+        # pending changes, None deletes the row
+        self._user_data: dict[int, Optional[bytes]] = {}
+        self._conversations: dict[tuple[str, str], Optional[int]] = {}
+        self._flush_scheduled = False
+        self._flush_lock = asyncio.Lock()
+        self._tasks: set[asyncio.Task] = set()
+
+    def _schedule_flush(self) -> None:
+        """all changes of one hand-over are buffered before the callback runs, so they go in one flush"""
+        if self._flush_scheduled:
+            return None
+        self._flush_scheduled = True
+        asyncio.get_running_loop().call_soon(self._start_flush)
+
+    def _start_flush(self) -> None:
+        self._flush_scheduled = False
+        task = asyncio.create_task(self._flush())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _flush(self) -> None:
+        async with self._flush_lock:
+            user_data, self._user_data = self._user_data, {}
+            conversations, self._conversations = self._conversations, {}
+            if not user_data and not conversations:
+                return None
+
+            start = time.perf_counter()
+            try:
+                await run_in_executor(self.executor, self.processor.write, user_data, conversations)
+            except Exception as e:
+                logger.error(f"{len(user_data)} user data and {len(conversations)} conversation states "
+                             f"were not persisted, exception - {e}")
+                # changes made since then are newer than the failed ones
+                self._user_data = {**user_data, **self._user_data}
+                self._conversations = {**conversations, **self._conversations}
+                return None
+            flush_time.observe(time.perf_counter() - start)
+            flushed_rows.inc(len(user_data), kind='user_data')
+            flushed_rows.inc(len(conversations), kind='conversation')
+
+    async def get_user_data(self) -> dict[int, dict]:
+        rows = await run_in_executor(self.executor, self.processor.load_user_data)
+        return {user_id: pickle.loads(data) for user_id, data in rows.items()}
+
+    async def get_chat_data(self) -> dict[int, dict]:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def get_conversations(self, name: str) -> dict[tuple, int]:
+        rows = await run_in_executor(self.executor, self.processor.load_conversations, name)
+        return {tuple(json.loads(key)): state for key, state in rows.items()}
+
+    async def update_conversation(self, name: str, key: tuple, new_state: Optional[object]) -> None:
+        self._conversations[(name, json.dumps(key))] = new_state
+        self._schedule_flush()
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        self._user_data[user_id] = pickle.dumps(data)
+        self._schedule_flush()
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._user_data[user_id] = None
+        self._schedule_flush()
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        pass
+
+    async def update_bot_data(self, data: dict) -> None:
+        pass
+
+    async def update_callback_data(self, data: object) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+    async def flush(self) -> None:
+        """called on shutdown after the last hand-over"""
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self._flush()
@@ -15,6 +15,10 @@ def deed_name_questions() -> str:
     return answer_names.deed_name_questions + '?'
 
 
+def deed_names_questions() -> str:
+    return answer_names.deed_names_questions
+
+
 def deed_added() -> str:
     return answer_names.deed_added
 
@@ -47,6 +51,18 @@ def deed_done() -> str:
     return answer_names.deed_done
 
 
+def next_notification() -> str:
+    return answer_names.next_notification
+
+
+def all_deeds_done() -> str:
+    return answer_names.all_deeds_done
+
+
+def done_all_question() -> str:
+    return answer_names.done_all_question
+
+
 def notification_canceled() -> str:
     return answer_names.notification_canceled
 
@@ -0,0 +1,145 @@
+"""Deed and its reminder in one message, e.g. "pay rent tomorrow 18:30" or "позвонить маме через 2ч".
+
+The time is looked for at the end of the message and the rest is the name of the deed:
+    <name> in|через <number><unit> [<number><unit> ...]     e.g. in 2h, in 1h 30m, через 15 минут
+    <name> [today|tomorrow|dd.mm[.yyyy]] HH:MM             e.g. tomorrow 18:30, 25.12 9:00
+    <name> [today|tomorrow|dd.mm[.yyyy]] at|в HH[:MM]      e.g. at 9, завтра в 18
+Times are local wall clock times of TZ like in the button flow. A message longer than MAX_LENGTH or with a
+time which has already passed, doesn't exist (31.02, 25:00) or is more than MAX_DELAY away is not a quick
+reminder. Only messages sent in the main menu are parsed: those in one of the forms above whose time can't be
+used are added as a deed named by the whole message and the bot asks for the time with buttons, other
+messages there are not deeds. A name answered after "add deed" is kept as it is.
+"""
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Optional
+from telegram import Message
+from telegram.ext import filters
+import re
+
+import utils.utils as ut
+
+_units = {
+    timedelta(minutes=1): ('m', 'min', 'mins', 'minute', 'minutes', 'м', 'мин', 'минуту', 'минуты', 'минут'),
+    timedelta(hours=1): ('h', 'hr', 'hrs', 'hour', 'hours', 'ч', 'час', 'часа', 'часов'),
+    timedelta(days=1): ('d', 'day', 'days', 'д', 'день', 'дня', 'дней'),
+    timedelta(weeks=1): ('w', 'week', 'weeks', 'нед', 'неделю', 'недели', 'недель'),
+}
+_unit_steps = {name: step for step, names in _units.items() for name in names}
+
+_day_words = {
+    'today': 0,
+    'сегодня': 0,
+    'tomorrow': 1,
+    'завтра': 1,
+    'послезавтра': 2,
+}
+
+# number and unit, amounts may follow each other like 1h30m or 1h 30m
+_amount = r'(?:\d+\s*)?[^\W\d_]+(?![^\W\d_])'
+_relative = re.compile(rf'(?P<name>.+)\s+(?:in|через)\s+(?P<amounts>{_amount}(?:\s*{_amount})*)', re.I)
+_amount_parts = re.compile(r'(\d*)\s*([^\W\d_]+)')
+_absolute = re.compile(
+    r'(?P<name>.+?)\s+'
+    r'(?:(?P<day>' + '|'.join(_day_words) + r'|\d{1,2}\.\d{1,2}(?:\.\d{4})?)\s+)?'
+    r'(?:(?:at|в)\s+(?P<at_hour>\d{1,2})(?::(?P<at_minute>\d{2}))?|(?P<hour>\d{1,2}):(?P<minute>\d{2}))',
+    re.I,
+)
+
+
+# matching is quadratic in the worst case, long messages are not quick reminders
+MAX_LENGTH = 256
+# reminders further away are typos rather than plans
+MAX_DELAY = timedelta(days=10 * 366)
+
+
+@dataclass
+class QuickReminder:
+    name: str
+    notify_time: datetime
+
+
+def _parse_relative(match: re.Match, now: datetime) -> Optional[datetime]:
+    delta = timedelta()
+    for number, unit in _amount_parts.findall(match['amounts']):
+        step = _unit_steps.get(unit.lower())
+        if step is None:
+            return None
+        # every amount is checked, so the sum can't overflow timedelta either
+        if int(number or 1) > MAX_DELAY / step:
+            return None
+        delta += step * int(number or 1)
+    return now + delta if delta else None
+
+
+def _parse_day(day: Optional[str], now: datetime) -> Optional[date]:
+    if day is None:
+        return None
+    if day.lower() in _day_words:
+        return now.date() + timedelta(days=_day_words[day.lower()])
+
+    day, month, *year = (int(part) for part in day.split('.'))
+    try:
+        parsed = date(year[0] if year else now.year, month, day)
+        # date without year is the next such day
+        if not year and parsed < now.date():
+            parsed = parsed.replace(year=now.year + 1)
+    except ValueError:
+        return None
+    return parsed
+
+
+def _parse_absolute(match: re.Match, now: datetime) -> Optional[datetime]:
+    hour = int(match['hour'] or match['at_hour'])
+    minute = int(match['minute'] or match['at_minute'] or 0)
+    if hour > 23 or minute > 59:
+        return None
+
+    day = _parse_day(match['day'], now)
+    if match['day'] and day is None:
+        return None
+    if day is None:
+        # only time is given, it is today or tomorrow if it has passed today
+        day = now.date()
+        if (hour, minute) <= (now.hour, now.minute):
+            day += timedelta(days=1)
+    # naive local time is localized like datetime.now() in the button flow
+    return ut.localize(datetime(day.year, day.month, day.day, hour, minute))
+
+
+def parse(text: str, now: datetime) -> Optional[QuickReminder]:
+    """None when text is not a quick reminder; now is localized current time"""
+    text = text.strip()
+    if len(text) > MAX_LENGTH:
+        return None
+    for pattern, parse_time in ((_relative, _parse_relative), (_absolute, _parse_absolute)):
+        match = pattern.fullmatch(text)
+        if match is None:
+            continue
+        try:
+            notify_time = parse_time(match, now)
+        except (OverflowError, ValueError):
+            # dates out of the range of datetime, e.g. near year 9999
+            continue
+        if notify_time is not None and now < notify_time and notify_time - now <= MAX_DELAY:
+            return QuickReminder(match['name'].strip(), notify_time)
+    return None
+
+
+def is_time_like(text: str) -> bool:
+    """text in one of the forms of a quick reminder, whether or not its time can be used"""
+    text = text.strip()
+    if len(text) > MAX_LENGTH:
+        return False
+    if _absolute.fullmatch(text):
+        return True
+    # "meet in the park" matches the relative form too, its words are not units
+    match = _relative.fullmatch(text)
+    return match is not None and all(unit.lower() in _unit_steps for _, unit in _amount_parts.findall(match['amounts']))
+
+
+class QuickReminderFilter(filters.MessageFilter):
+    """text messages in the form of a quick reminder, see is_time_like"""
+
+    def filter(self, message: Message) -> bool:
+        return bool(message.text) and is_time_like(message.text)
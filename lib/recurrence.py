@@ -0,0 +1,42 @@
+"""Recurrence rules of deeds.
+
+A recurring deed stores only its next occurrence in notify_time. When the notification fires the following
+occurrence is computed from the rule and stored instead, a series is never expanded.
+"""
+from datetime import datetime, timedelta
+from typing import Optional
+
+import utils.utils as ut
+
+DAILY = 'daily'
+WEEKDAYS = 'weekdays'
+WEEKLY = 'weekly'
+
+RECURRENCES = (DAILY, WEEKDAYS, WEEKLY)
+
+_steps = {
+    DAILY: timedelta(days=1),
+    WEEKDAYS: timedelta(days=1),
+    WEEKLY: timedelta(weeks=1),
+}
+
+
+def is_valid(recurrence: Optional[str]) -> bool:
+    """rule stored in db or sent in a callback is one of the known ones, unknown rules are ignored"""
+    return recurrence is None or recurrence in RECURRENCES
+
+
+def next_occurrence(notify_time: datetime, recurrence: str, after: datetime) -> datetime:
+    """first occurrence of the series later than after, missed occurrences are skipped arithmetically;
+    steps are made in local wall clock time, so the reminder keeps its hour over DST changes"""
+    step = _steps[recurrence]
+    wall_time = ut.localize(notify_time).replace(tzinfo=None)
+    after_wall_time = ut.localize(after).replace(tzinfo=None)
+
+    if wall_time <= after_wall_time:
+        wall_time += ((after_wall_time - wall_time) // step + 1) * step
+    if recurrence == WEEKDAYS:
+        while wall_time.weekday() >= 5:
+            wall_time += step
+
+    return ut.localize(wall_time)
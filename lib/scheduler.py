@@ -0,0 +1,194 @@
+"""Notification schedulers used by Client.
+
+Scheduler keeps at most one pending notification per deed and calls `callback(deed_id, user_id)` when it
+is due. Lookup by deed id is a dict access, so cancel and reschedule don't depend on the number of
+pending notifications.
+
+JobQueueScheduler runs every notification as a JobQueue job. HeapScheduler keeps compact entries in a heap
+driven by one asyncio task, it is meant for very large numbers of pending reminders.
+"""
+from datetime import datetime
+from heapq import heappush, heappop, heapify
+from typing import Awaitable, Callable, Union
+from telegram.ext import ContextTypes, Job, JobQueue
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+NotificationCallback = Callable[[int, int], Awaitable[None]]
+
+
+class JobQueueScheduler:
+    """pending notifications are jobs of python-telegram-bot JobQueue, indexed by deed id"""
+
+    def __init__(self, job_queue: JobQueue, callback: NotificationCallback):
+        self.job_queue = job_queue
+        self.callback = callback
+        self._jobs: dict[int, Job] = {}
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    def __contains__(self, deed_id: int) -> bool:
+        return deed_id in self._jobs
+
+    def start(self) -> None:
+        """jobs are run by the job queue of the application"""
+
+    async def stop(self) -> None:
+        """jobs are stopped by the application"""
+
+    def schedule(self, deed_id: int, user_id: int, when: datetime) -> None:
+        """schedule notification, previous notification of the deed is replaced"""
+        previous = self._jobs.pop(deed_id, None)
+        if previous is not None:
+            previous.schedule_removal()
+        self._jobs[deed_id] = self.job_queue.run_once(self._fire, when=when, user_id=user_id,
+                                                      data=deed_id, name=str(deed_id))
+
+    def cancel(self, deed_id: int) -> bool:
+        job = self._jobs.pop(deed_id, None)
+        if job is None:
+            logger.debug(f"Job {deed_id=} does not exist at jobs")
+            return False
+        job.schedule_removal()
+        logger.debug(f"Job {job=} removed")
+        return True
+
+    def cancel_users(self, predicate: Callable[[int], bool]) -> int:
+        """cancel notifications of users matching predicate, returns their number"""
+        deed_ids = [deed_id for deed_id, job in self._jobs.items() if predicate(job.user_id)]
+        for deed_id in deed_ids:
+            self._jobs.pop(deed_id).schedule_removal()
+        return len(deed_ids)
+
+    async def _fire(self, context: ContextTypes.DEFAULT_TYPE) -> None:
+        job = context.job
+        deed_id = job.data
+        if self._jobs.get(deed_id) is job:
+            del self._jobs[deed_id]
+        await self.callback(deed_id, job.user_id)
+
+
+class TimerEntry:
+
+    __slots__ = ('due', 'deed_id', 'user_id', 'cancelled')
+
+    def __init__(self, due: float, deed_id: int, user_id: int):
+        self.due = due
+        self.deed_id = deed_id
+        self.user_id = user_id
+        self.cancelled = False
+
+    def __lt__(self, other: 'TimerEntry') -> bool:
+        return self.due < other.due
+
+
+class HeapScheduler:
+    """binary heap of TimerEntry with lazy deletion: cancel only marks the entry,
+    marked entries are skipped when they reach the top and the heap is compacted when they pile up"""
+
+    # wall clock can be moved, driver doesn't sleep longer than that
+    max_sleep = 60
+
+    def __init__(self, callback: NotificationCallback):
+        self.callback = callback
+        self._heap: list[TimerEntry] = []
+        self._entries: dict[int, TimerEntry] = {}
+        self._cancelled = 0
+        self._wakeup: asyncio.Event = None
+        self._driver: asyncio.Task = None
+        self._tasks: set[asyncio.Task] = set()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, deed_id: int) -> bool:
+        return deed_id in self._entries
+
+    def start(self) -> None:
+        self._wakeup = asyncio.Event()
+        self._driver = asyncio.create_task(self._drive())
+        logger.info(f"heap scheduler was started with {len(self)} pending notifications")
+
+    async def stop(self) -> None:
+        if self._driver is None:
+            return None
+        self._driver.cancel()
+        await asyncio.gather(self._driver, *self._tasks, return_exceptions=True)
+        self._driver = None
+
+    def schedule(self, deed_id: int, user_id: int, when: Union[datetime, float]) -> None:
+        """when is datetime or seconds from now, previous notification of the deed is replaced"""
+        due = when.timestamp() if isinstance(when, datetime) else time.time() + when
+        self.cancel(deed_id)
+
+        entry = TimerEntry(due, deed_id, user_id)
+        wakeup = not self._heap or entry < self._heap[0]
+        heappush(self._heap, entry)
+        self._entries[deed_id] = entry
+        if wakeup and self._wakeup is not None:
+            self._wakeup.set()
+
+    def cancel(self, deed_id: int) -> bool:
+        entry = self._entries.pop(deed_id, None)
+        if entry is None:
+            return False
+        entry.cancelled = True
+        self._cancelled += 1
+        if self._cancelled > 1024 and self._cancelled > len(self._heap) // 2:
+            self._compact()
+        return True
+
+    def cancel_users(self, predicate: Callable[[int], bool]) -> int:
+        """cancel notifications of users matching predicate, returns their number"""
+        deed_ids = [deed_id for deed_id, entry in self._entries.items() if predicate(entry.user_id)]
+        for deed_id in deed_ids:
+            self.cancel(deed_id)
+        return len(deed_ids)
+
+    def _compact(self) -> None:
+        self._heap = [entry for entry in self._heap if not entry.cancelled]
+        heapify(self._heap)
+        self._cancelled = 0
+
+    def _pop_due(self, now: float) -> list[TimerEntry]:
+        due_entries = []
+        while self._heap:
+            entry = self._heap[0]
+            if entry.cancelled:
+                heappop(self._heap)
+                self._cancelled -= 1
+            elif entry.due <= now:
+                heappop(self._heap)
+                del self._entries[entry.deed_id]
+                due_entries.append(entry)
+            else:
+                break
+        return due_entries
+
+    def _fire(self, entry: TimerEntry) -> None:
+        task = asyncio.create_task(self.callback(entry.deed_id, entry.user_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._fire_done)
+
+    def _fire_done(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception():
+            logger.error(f"notification callback failed, exception - {task.exception()}")
+
+    async def _drive(self) -> None:
+        while True:
+            self._wakeup.clear()
+            for entry in self._pop_due(time.time()):
+                self._fire(entry)
+
+            timeout = self.max_sleep
+            if self._heap:
+                timeout = min(timeout, max(0.0, self._heap[0].due - time.time()))
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
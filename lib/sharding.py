@@ -0,0 +1,138 @@
+"""Split of notification firing between bot instances.
+
+Users are split into shards by abs(telegram_id) % num_shards. Every instance heartbeats into bot_instance
+and keeps leases of about num_shards / live instances shards in shard_lease, renewing them on every
+heartbeat. Leases of a stopped or dead instance expire after lease_ttl and are taken over by the others,
+surplus leases are released when a new instance joins.
+
+An instance loads from db only notifications of its shards. Delivery itself is claimed per notification
+(see DeedProcessor.claim_notifications), so a notification handed over between instances is still
+delivered once.
+"""
+from concurrent.futures import Executor
+from datetime import datetime, timedelta
+from sqlalchemy import insert, update, delete, select, func, or_
+import logging
+import os
+import socket
+import time
+
+from lib.backend import TableProcessor, db_executor, run_in_executor
+from lib.db.deed import ShardLease, BotInstance
+from lib.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+owned_shards = registry.gauge('notification_shards_owned', 'notification shards leased by this instance')
+
+
+class LeaseProcessor(TableProcessor):
+
+    @db_executor
+    def ensure_shards(self, num_shards: int, session=None) -> None:
+        """lease rows are created once for every shard"""
+        leases = ShardLease.__table__
+        existing = set(session.execute(select(leases.c.shard)).scalars())
+        missing = [{'shard': shard, 'owner': None, 'expires_at': None}
+                   for shard in range(num_shards) if shard not in existing]
+        if missing:
+            session.execute(insert(leases), missing)
+
+    @db_executor
+    def rebalance(self, instance_id: str, num_shards: int, lease_ttl: float, session=None) -> list[int]:
+        """heartbeat of instance: renew own leases, release surplus or take free and expired ones up to
+        a fair share, returns shards owned after it"""
+        instances = BotInstance.__table__
+        leases = ShardLease.__table__
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=lease_ttl)
+
+        heartbeat = update(instances).where(instances.c.instance_id == instance_id).values(expires_at=expires_at)
+        if not session.execute(heartbeat).rowcount:
+            session.execute(insert(instances).values(instance_id=instance_id, expires_at=expires_at))
+        session.execute(delete(instances).where(instances.c.expires_at < now))
+        live_instances = session.execute(select(func.count()).select_from(instances)).scalar()
+        fair_share = -(-num_shards // live_instances)
+
+        own = leases.c.owner == instance_id
+        session.execute(update(leases).where(own).values(expires_at=expires_at))
+        owned = session.execute(
+            select(leases.c.shard).where(own).where(leases.c.shard < num_shards).order_by(leases.c.shard)
+        ).scalars().all()
+
+        if len(owned) > fair_share:
+            surplus = owned[fair_share:]
+            session.execute(update(leases).where(own).where(leases.c.shard.in_(surplus))
+                            .values(owner=None, expires_at=None))
+            owned = owned[:fair_share]
+        elif len(owned) < fair_share:
+            free = or_(leases.c.owner.is_(None), leases.c.expires_at < now)
+            candidates = session.execute(
+                select(leases.c.shard).where(free).where(leases.c.shard < num_shards)
+                .order_by(leases.c.shard).limit(fair_share - len(owned))
+            ).scalars().all()
+            for shard in candidates:
+                # another instance could take the shard since the select, the update checks it again
+                take = update(leases).where(leases.c.shard == shard).where(free)
+                if session.execute(take.values(owner=instance_id, expires_at=expires_at)).rowcount:
+                    owned.append(shard)
+
+        return sorted(owned)
+
+    @db_executor
+    def release(self, instance_id: str, session=None) -> None:
+        leases = ShardLease.__table__
+        instances = BotInstance.__table__
+        session.execute(update(leases).where(leases.c.owner == instance_id).values(owner=None, expires_at=None))
+        session.execute(delete(instances).where(instances.c.instance_id == instance_id))
+
+
+class ShardOwnership:
+    """shards of notifications leased by this instance, rebalance has to be called every lease_ttl / 3"""
+
+    def __init__(self, engine, executor: Executor, num_shards: int = 64, lease_ttl: float = 30,
+                 instance_id: str = None):
+        self.leases = LeaseProcessor(engine)
+        self.executor = executor
+        self.num_shards = num_shards
+        self.lease_ttl = lease_ttl
+        self.instance_id = instance_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.owned: frozenset[int] = frozenset()
+        # own leases can't be trusted after that monotonic time if heartbeats fail
+        self._valid_until = 0.0
+        self._shards_created = False
+
+    def shard_of(self, telegram_id: int) -> int:
+        return abs(telegram_id) % self.num_shards
+
+    async def rebalance(self) -> tuple[frozenset[int], frozenset[int]]:
+        """returns shards gained and lost since the previous call"""
+        started = time.monotonic()
+        try:
+            if not self._shards_created:
+                await run_in_executor(self.executor, self.leases.ensure_shards, self.num_shards)
+                self._shards_created = True
+            owned = frozenset(await run_in_executor(self.executor, self.leases.rebalance, self.instance_id,
+                                                    self.num_shards, self.lease_ttl))
+            self._valid_until = started + self.lease_ttl
+        except Exception as e:
+            logger.error(f"shard leases of {self.instance_id} were not renewed, exception - {e}")
+            owned = self.owned if time.monotonic() < self._valid_until else frozenset()
+
+        gained, lost = owned - self.owned, self.owned - owned
+        self.owned = owned
+        owned_shards.set(len(owned))
+        if gained or lost:
+            logger.info(f"{self.instance_id} owns {len(owned)} of {self.num_shards} shards, "
+                        f"gained {sorted(gained)}, lost {sorted(lost)}")
+        return gained, lost
+
+    async def release(self) -> None:
+        """give shards away on shutdown, so other instances take them without waiting for expiry"""
+        try:
+            await run_in_executor(self.executor, self.leases.release, self.instance_id)
+            logger.info(f"shard leases of {self.instance_id} were released")
+        except Exception as e:
+            logger.error(f"shard leases of {self.instance_id} were not released, exception - {e}")
+        self.owned = frozenset()
+        owned_shards.set(0)
@@ -1,7 +1,9 @@
 import os
 import time
+from datetime import timedelta
 from lib.client import Client
 from lib.db.deed import get_engine, create_data_base_and_tables
+from lib.logs import parse_levels, setup_logging
 import logging
 
 logger = logging.getLogger(__name__)
@@ -12,14 +14,79 @@ if __name__ == '__main__':
     POSTGRES_PASSWORD = os.getenv('POSTGRES_PASSWORD', '1234')
     POSTGRES_HOST = os.getenv('POSTGRES_HOST', 'localhost')
     POSTGRES_PORT = os.getenv('POSTGRES_PORT', '1349')
+    DB_WORKERS = int(os.getenv('DB_WORKERS', '8'))
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', str(DB_WORKERS)))
+    DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '4'))
+    DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '1800'))
+    DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', '1') == '1'
+    DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '30'))
+    DEED_CACHE_SIZE = int(os.getenv('DEED_CACHE_SIZE', '10000'))
+    DEED_CACHE_TTL = float(os.getenv('DEED_CACHE_TTL', '300'))
+    DEEDS_PAGE_SIZE = int(os.getenv('DEEDS_PAGE_SIZE', '10'))
+    NOTIFICATION_WINDOW = int(os.getenv('NOTIFICATION_WINDOW', '60'))
+    NOTIFICATION_RATE = float(os.getenv('NOTIFICATION_RATE', '30'))
+    NOTIFICATION_CHAT_INTERVAL = float(os.getenv('NOTIFICATION_CHAT_INTERVAL', '1'))
+    SCHEDULER_ENGINE = os.getenv('SCHEDULER_ENGINE', 'job_queue')
+    NOTIFICATION_SHARDS = int(os.getenv('NOTIFICATION_SHARDS', '0'))
+    SHARD_LEASE_TTL = float(os.getenv('SHARD_LEASE_TTL', '30'))
+    INSTANCE_ID = os.getenv('INSTANCE_ID') or None
+    CONCURRENT_CHATS = int(os.getenv('CONCURRENT_CHATS', '64'))
+    WEBHOOK_URL = os.getenv('WEBHOOK_URL') or None
+    WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+    WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+    WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or None
+    PERSISTENCE_INTERVAL = float(os.getenv('PERSISTENCE_INTERVAL', '5'))
+    METRICS_DUMP_INTERVAL = int(os.getenv('METRICS_DUMP_INTERVAL', '60'))
+    METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+    LOG_LEVELS = parse_levels(os.getenv('LOG_LEVELS', ''))
+    LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', str(10 * 1024 * 1024)))
+    LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', '5'))
     API_TOKEN = os.getenv('NOTIFICATION_BOT_TOKEN', '214139458:AAH8UGU0PW3vUE1lRz-gjXnlB6TroUvpfUk')
     # just a test bot by default for testing
 
     os.environ['TZ'] = TZ
     time.tzset()
 
-    engine = get_engine(POSTGRES_PASSWORD, POSTGRES_PORT, POSTGRES_HOST)
+    setup_logging(
+        levels=LOG_LEVELS,
+        max_bytes=LOG_MAX_BYTES,
+        backup_count=LOG_BACKUP_COUNT,
+    )
+
+    engine = get_engine(
+        POSTGRES_PASSWORD,
+        POSTGRES_PORT,
+        POSTGRES_HOST,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        pool_timeout=DB_POOL_TIMEOUT,
+    )
     create_data_base_and_tables(engine)
 
-    client = Client(API_TOKEN, engine)
-    client.build_application()
+    client = Client(
+        API_TOKEN,
+        engine,
+        db_workers=DB_WORKERS,
+        metrics_dump_interval=METRICS_DUMP_INTERVAL,
+        metrics_port=METRICS_PORT,
+        cache_size=DEED_CACHE_SIZE,
+        cache_ttl=DEED_CACHE_TTL,
+        deeds_page_size=DEEDS_PAGE_SIZE,
+        notification_window=timedelta(minutes=NOTIFICATION_WINDOW),
+        notification_rate=NOTIFICATION_RATE,
+        notification_chat_interval=NOTIFICATION_CHAT_INTERVAL,
+        scheduler_engine=SCHEDULER_ENGINE,
+        notification_shards=NOTIFICATION_SHARDS,
+        shard_lease_ttl=SHARD_LEASE_TTL,
+        instance_id=INSTANCE_ID,
+        concurrent_chats=CONCURRENT_CHATS,
+        persistence_interval=PERSISTENCE_INTERVAL,
+    )
+    client.build_application(
+        webhook_url=WEBHOOK_URL,
+        webhook_listen=WEBHOOK_LISTEN,
+        webhook_port=WEBHOOK_PORT,
+        webhook_secret=WEBHOOK_SECRET,
+    )
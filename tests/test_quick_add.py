@@ -0,0 +1,70 @@
+import os
+import time
+import unittest
+from datetime import datetime, timedelta
+
+import pytz
+
+from lib import quick_add
+
+UTC = pytz.timezone('UTC')
+
+
+def setUpModule():
+    # parser localizes wall clock times with TZ like the bot does
+    os.environ['TZ'] = 'UTC'
+    time.tzset()
+
+
+class ParseTest(unittest.TestCase):
+
+    now = UTC.localize(datetime(2026, 10, 18, 12, 0))
+
+    def assertReminder(self, text: str, name: str, notify_time: datetime):
+        self.assertEqual(quick_add.parse(text, self.now), quick_add.QuickReminder(name, notify_time))
+
+    def test_relative(self):
+        self.assertReminder('call mom in 2h', 'call mom', self.now + timedelta(hours=2))
+        self.assertReminder('позвонить маме через 1ч 30м', 'позвонить маме', self.now + timedelta(minutes=90))
+        self.assertReminder('water plants in 2 days', 'water plants', self.now + timedelta(days=2))
+
+    def test_absolute(self):
+        self.assertReminder('pay rent tomorrow 18:30', 'pay rent', UTC.localize(datetime(2026, 10, 19, 18, 30)))
+        self.assertReminder('встреча завтра в 18', 'встреча', UTC.localize(datetime(2026, 10, 19, 18, 0)))
+        self.assertReminder('buy tickets for 25.12 9:00', 'buy tickets for', UTC.localize(datetime(2026, 12, 25, 9)))
+
+    def test_time_which_passed_today_is_tomorrow(self):
+        self.assertReminder('standup 10:00', 'standup', UTC.localize(datetime(2026, 10, 19, 10, 0)))
+
+    def test_not_quick_reminders(self):
+        for text in ('just a deed', 'x today 09:00', 'x 31.02 10:00', 'x 25:00', 'x in 2 parsecs',
+                     'x ' * quick_add.MAX_LENGTH + 'in 2h'):
+            with self.subTest(text=text):
+                self.assertIsNone(quick_add.parse(text, self.now))
+
+    def test_huge_amounts(self):
+        for text in ('x in 99999999 weeks', 'x in 999999999999 days', 'x in 9999999999999999999999 m',
+                     'x in 5000 days', 'x 01.01.9999 10:00'):
+            with self.subTest(text=text):
+                self.assertIsNone(quick_add.parse(text, self.now))
+
+    def test_end_of_datetime_range(self):
+        now = UTC.localize(datetime(9999, 12, 31, 23, 30))
+        self.assertIsNone(quick_add.parse('x 23:00', now))
+
+
+class IsTimeLikeTest(unittest.TestCase):
+
+    def test_forms_with_unusable_times(self):
+        for text in ('pay rent today 09:00', 'x 31.02 10:00', 'x 25:00', 'x in 99999999 weeks', 'x in 2h'):
+            with self.subTest(text=text):
+                self.assertTrue(quick_add.is_time_like(text))
+
+    def test_other_text(self):
+        for text in ('just a deed', 'meet in the park', 'x in 2 parsecs', 'x ' * quick_add.MAX_LENGTH + '10:00'):
+            with self.subTest(text=text):
+                self.assertFalse(quick_add.is_time_like(text))
+
+
+if __name__ == '__main__':
+    unittest.main()